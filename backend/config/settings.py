@@ -12,6 +12,9 @@ class Settings(BaseSettings):
     SUPABASE_URL: str
     SUPABASE_KEY: str
     SUPABASE_BUCKET_NAME: str = "health-docs"
+    # Per-request timeouts (seconds) for the shared Supabase client
+    SUPABASE_POSTGREST_TIMEOUT: int = 30
+    SUPABASE_STORAGE_TIMEOUT: int = 20
     
     # ADD THIS LINE
     CORS_ORIGINS: List[str] = ["http://localhost:4200"] 
@@ -19,6 +22,24 @@ class Settings(BaseSettings):
     CHUTES_AI_ENDPOINT: str = "https://llm.chutes.ai/v1"
     CHUTES_AI_MODEL: str = "chutesai/Mistral-Small-3.2-24B-Instruct-2506"
     MISTRAL_OCR_MODEL: str = "mistral-ocr-latest"
+    MISTRAL_EXTRACTION_MODEL: str = "mistral-large-latest"
+    # Max simultaneous LLM requests per provider, to stay under their rate limits
+    MISTRAL_MAX_CONCURRENT_REQUESTS: int = 4
+    CHUTES_AI_MAX_CONCURRENT_REQUESTS: int = 4
+    # Attempts per OCR/LLM request when the provider answers 429 (backoff in between)
+    AI_RATE_LIMIT_MAX_ATTEMPTS: int = 3
+    # Consecutive provider failures before OCR/LLM calls fail fast, and for how long (seconds)
+    AI_CIRCUIT_BREAKER_FAIL_MAX: int = 5
+    AI_CIRCUIT_BREAKER_RESET_SECONDS: int = 30
+    # Max documents going through OCR + AI analysis at once; further uploads wait their turn
+    PIPELINE_MAX_CONCURRENT_DOCUMENTS: int = 3
+    # Re-queue documents left in "processing" by a restart; disable when running several workers
+    PIPELINE_RESUME_ON_STARTUP: bool = True
+    # Worker threads for blocking calls (OCR client, Supabase queries, storage uploads);
+    # long OCR requests must not starve the short database calls sharing the pool
+    BLOCKING_IO_MAX_THREADS: int = 32
+    # Days an LLM response is reused for an identical document/marker set (0 disables the cache)
+    LLM_CACHE_TTL_DAYS: int = 7
     UPLOAD_DIR: str = "uploads"
     model_config = SettingsConfigDict(env_file=".env", extra='ignore')
 
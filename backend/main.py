@@ -1,12 +1,14 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, APIRouter
+from typing import List, Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, APIRouter, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 import uvicorn
 import os
-import logging
-import json
 import asyncio
+import logging
+import orjson
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from services.document_processor import DocumentProcessor
 from config.settings import settings # <-- MAKE SURE THIS IS IMPORTED
@@ -21,8 +23,16 @@ document_processor = DocumentProcessor()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting Health Document Analyzer API v4")
+    # asyncio.to_thread runs on the default executor, which is sized from the CPU count
+    # (min(32, cpus + 4)); on small hosts a few OCR calls would leave no thread for queries
+    executor = ThreadPoolExecutor(max_workers=settings.BLOCKING_IO_MAX_THREADS, thread_name_prefix="blocking-io")
+    asyncio.get_running_loop().set_default_executor(executor)
+    if settings.PIPELINE_RESUME_ON_STARTUP:
+        await document_processor.resume_interrupted_documents()
     yield
     logger.info("Shutting down Health Document Analyzer API")
+    await document_processor.close()
+    executor.shutdown(wait=False, cancel_futures=True)
 
 app = FastAPI(
     title="Health Document Analyzer API",
@@ -45,14 +55,17 @@ app.add_middleware(
 api_router_v1 = APIRouter(prefix="/api/v1")
 
 @api_router_v1.post("/documents/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Uploads and begins processing of a health document."""
+async def upload_document(
+    file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
+):
+    """Uploads and begins processing of a health document (replays with the same Idempotency-Key are not re-processed)."""
     try:
         # We no longer validate file type here, can be done on frontend
         # and/or inferred by content type if needed
         
-        file_content = await file.read()
-        document_id = await document_processor.process_document(file_content, file.filename)
+        # Stream the spooled upload to storage instead of reading it into memory
+        document_id = await document_processor.process_document(file.file, file.filename, idempotency_key)
         
         return {"document_id": document_id, "filename": file.filename}
         
@@ -60,24 +73,47 @@ async def upload_document(file: UploadFile = File(...)):
         logger.error(f"Upload error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+@api_router_v1.post("/documents/upload/batch")
+async def upload_documents(files: List[UploadFile] = File(...)):
+    """Uploads several health documents at once and begins processing each of them."""
+    try:
+        document_ids = await document_processor.process_documents([(file.file, file.filename) for file in files])
+        
+        return [
+            {"document_id": document_id, "filename": file.filename}
+            for document_id, file in zip(document_ids, files)
+        ]
+        
+    except Exception as e:
+        logger.error(f"Batch upload error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
 @api_router_v1.get("/documents/{document_id}/stream")
 async def stream_document_analysis(document_id: str):
     """Streams the analysis status of a document using SSE."""
     async def event_generator():
+        last_event = None
         while True:
-            doc_data = document_processor.get_analysis(document_id)
+            doc_data = await document_processor.get_analysis(document_id)
             if doc_data:
-                yield f"data: {json.dumps(doc_data)}\n\n"
+                event = b"data: " + orjson.dumps(doc_data) + b"\n\n"
+                if event != last_event:
+                    yield event
+                    last_event = event
                 if doc_data["status"] in ["complete", "error"]:
                     break
-            await asyncio.sleep(2) # Poll every 2 seconds
+            # Woken by each stage write in this process; re-check every 2 seconds regardless
+            await document_processor.wait_for_update(document_id, timeout=2)
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 @api_router_v1.get("/documents")
-async def list_documents():
-    """List all processed documents"""
+async def list_documents(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0)
+):
+    """List processed documents, newest first (optionally paged with limit/offset)"""
     try:
-        documents = await document_processor.list_documents()
+        documents = await document_processor.list_documents(limit, offset)
         return documents
         
     except Exception as e:
@@ -88,7 +124,7 @@ async def list_documents():
 async def get_document(document_id: str):
     """Get a specific document by ID"""
     try:
-        doc_data = document_processor.get_analysis(document_id)
+        doc_data = await document_processor.get_analysis(document_id)
         if not doc_data:
             raise HTTPException(status_code=404, detail=f"Document with ID {document_id} not found")
         return doc_data
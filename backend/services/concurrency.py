@@ -0,0 +1,282 @@
+"""
+Concurrency Utilities
+
+Helpers for bounding, de-duplicating and retrying outbound calls.
+Shared by the OCR stage, the extraction and insight agents, and the storage and
+database clean-up paths.
+
+The AI agents stack them the same way for every request: identical requests in
+flight share one call (RequestCoalescer), which may be answered from the LLM
+response cache; the provider slot (a per-provider semaphore) is only held while
+the request is sent, so rate-limited attempts back off outside it
+(retry_on_rate_limit); and a CircuitBreaker around the retries fails documents
+fast while the provider keeps failing.
+"""
+
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import requests
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Lower-cased fragments identifying a rate-limit error whose status code was not kept
+# (e.g. re-raised as a plain exception; a bare "429" could be part of a URL)
+RATE_LIMIT_MARKERS = ("429 client error", "too many requests", "rate limit", "quota")
+RATE_LIMIT_MAX_DELAY_SECONDS = 30.0
+RETRY_MAX_DELAY_SECONDS = 10.0
+
+
+def _http_status(error: BaseException) -> Optional[int]:
+    """Return the HTTP status of an httpx or requests error response, if it has one."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code
+    return None
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    Tell whether an error is a provider rate limit (worth retrying after a pause).
+
+    Args:
+        error: Exception raised by the provider call
+
+    Returns:
+        bool: True for HTTP 429 or a rate-limit/quota message
+    """
+    status = _http_status(error)
+    if status is not None:
+        return status == 429
+    message = str(error).lower()
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """
+    Tell whether an error means the provider itself is failing (not a bad request).
+
+    Anything else (4xx responses, unsupported files, unparseable output) is the
+    request's fault and must not open a circuit shared by every user.
+
+    Args:
+        error: Exception raised by the provider call
+
+    Returns:
+        bool: True for rate limits, 5xx responses, timeouts and connection errors
+    """
+    status = _http_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (
+        httpx.TimeoutException, httpx.NetworkError,
+        requests.Timeout, requests.ConnectionError,
+        TimeoutError, ConnectionError
+    ))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a provider is down instead of letting every document wait out its timeouts.
+
+    After `fail_max` consecutive provider failures the circuit opens and calls raise
+    CircuitOpenError immediately. Once `reset_timeout` has passed, calls go through
+    again: the first success closes the circuit, a failure re-opens it at once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fail_max: int = settings.AI_CIRCUIT_BREAKER_FAIL_MAX,
+        reset_timeout: float = settings.AI_CIRCUIT_BREAKER_RESET_SECONDS
+    ):
+        """
+        Initialize a closed circuit.
+
+        Args:
+            name: Label used in errors and log messages (e.g. the agent name)
+            fail_max: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open before calls are tried again
+        """
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently being rejected."""
+        return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout
+
+    async def call(self, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `call` unless the circuit is open.
+
+        Args:
+            call: Zero-argument coroutine factory performing the request
+
+        Returns:
+            The result of the call
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+        """
+        if self.is_open:
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable after repeated failures, retry later")
+
+        try:
+            result = await call()
+        except Exception as e:
+            if is_provider_failure(e):
+                self._record_failure()
+            raise
+
+        if self._opened_at is not None:
+            logger.info(f"{self.name}: circuit closed, provider is responding again")
+        self._failures = 0
+        self._opened_at = None
+        return result
+
+    def _record_failure(self) -> None:
+        """Count a provider failure and open the circuit once the threshold is reached."""
+        self._failures += 1
+        if self._failures >= self.fail_max:
+            if not self.is_open:
+                logger.warning(f"{self.name}: circuit opened after {self._failures} consecutive failures")
+            self._opened_at = time.monotonic()
+
+
+async def retry_with_backoff(
+    name: str,
+    call: Callable[[], Awaitable[T]],
+    max_attempts: int = 3,
+    base_delay: float = 1.0,
+    max_delay: float = RETRY_MAX_DELAY_SECONDS,
+    should_retry: Callable[[Exception], bool] = lambda _: True
+) -> T:
+    """
+    Run `call`, retrying failed attempts with randomized exponential backoff.
+
+    The random ("full jitter") delay keeps callers that failed together from
+    retrying in lockstep.
+
+    Args:
+        name: Label used in log messages (e.g. the agent or operation name)
+        call: Zero-argument coroutine factory performing the request
+        max_attempts: Total attempts, the first one included
+        base_delay: Minimum delay, doubled as the cap of each following wait
+        max_delay: Upper bound of any single wait
+        should_retry: Tells whether an error is worth another attempt
+
+    Returns:
+        The result of the first successful attempt
+
+    Raises:
+        The last error, or the first one `should_retry` rejects
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == max_attempts or not should_retry(e):
+                raise
+            delay = max(base_delay, random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+            logger.warning(f"{name}: attempt {attempt}/{max_attempts} failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def retry_on_rate_limit(
+    name: str,
+    call: Callable[[], Awaitable[T]],
+    max_attempts: int = settings.AI_RATE_LIMIT_MAX_ATTEMPTS,
+    base_delay: float = 1.0
+) -> T:
+    """
+    Run a provider request, retrying only rate-limited attempts (other errors raise at once).
+
+    Args:
+        name: Label used in log messages (e.g. the agent name)
+        call: Zero-argument coroutine factory performing the request
+        max_attempts: Total attempts, the first one included
+        base_delay: Minimum delay between attempts
+
+    Returns:
+        The result of the first successful attempt
+    """
+    return await retry_with_backoff(
+        name, call, max_attempts, base_delay, RATE_LIMIT_MAX_DELAY_SECONDS, should_retry=is_rate_limit_error
+    )
+
+
+class RequestCoalescer:
+    """
+    Shares one in-flight call between concurrent callers asking for the same payload.
+
+    The first caller for a key starts the call; callers arriving while it is still
+    running await the same task instead of sending a duplicate request. The entry
+    is dropped as soon as the call finishes, so nothing is cached afterwards.
+    """
+
+    def __init__(self, name: str):
+        """
+        Initialize an empty coalescer.
+
+        Args:
+            name: Label used in log messages (e.g. the agent name)
+        """
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """
+        Build a compact key from the request parts (model, prompt payload...).
+
+        Args:
+            parts: Strings identifying the request
+
+        Returns:
+            str: SHA-256 hex digest of the parts
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    async def run(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `call` for `key`, or join the identical call already in flight.
+
+        Args:
+            key: Request key, usually from `make_key`
+            call: Zero-argument coroutine factory performing the request
+
+        Returns:
+            The result of the (possibly shared) call
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.info(f"{self.name}: joining identical in-flight request")
+
+        # Shield so one caller being cancelled does not cancel the others' request
+        return await asyncio.shield(task)
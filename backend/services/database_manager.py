@@ -3,17 +3,66 @@ Database Manager Module
 
 Handles all database operations for document management including CRUD operations,
 analysis results, and health markers persistence.
+
+supabase-py's client is synchronous, so every query is executed in a worker thread
+(see `_execute`) to keep network I/O off the event loop.
 """
 
+import asyncio
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from cachetools import TLRUCache, TTLCache
+from postgrest.types import ReturnMethod
 from supabase import Client
 
-from models.health_models import HealthInsights
-
 logger = logging.getLogger(__name__)
 
+# Short-lived read cache: absorbs repeated reads of the same row (delete retries,
+# SSE polling) while keeping progress updates visible within a few seconds.
+# Completed documents no longer change, so they are kept longer.
+READ_CACHE_MAX_SIZE = 1024
+READ_CACHE_TTL_SECONDS = 5
+COMPLETE_CACHE_TTL_SECONDS = 300
+# Document list pages, dropped on any document write (the list shows live progress)
+LIST_CACHE_MAX_SIZE = 64
+LIST_CACHE_TTL_SECONDS = 2
+
+# Progress percentage reported for each processing stage (read-only, shared)
+STAGE_PROGRESS = MappingProxyType({
+    "ocr_extraction": 10,
+    "ai_analysis": 50,
+    "saving_results": 90,
+    "complete": 100
+})
+
+# Writes never use the affected rows, so ask PostgREST not to echo them back
+# (a documents row carries the full OCR raw_text)
+NO_RETURN = ReturnMethod.minimal
+
+# Columns needed by the lifecycle operations (delete, retry); leaves out raw_text,
+# which can be hundreds of KB for multi-page reports
+DOCUMENT_METADATA_COLUMNS = "id, filename, status, storage_path, public_url, processing_stage, progress"
+
+# Frontend field names are produced by PostgREST aliases (and a JSON path for the
+# markers), so rows come back in the response shape and need no per-key reshaping
+DOCUMENT_LIST_COLUMNS = (
+    "id, document_id:id, filename, uploaded_at:upload_date, status, processed_at, "
+    "public_url, error_message, progress, processing_stage, marker_count"
+)
+DOCUMENT_DETAIL_COLUMNS = (
+    "id, document_id:id, filename, uploaded_at:upload_date, status, processed_at, "
+    "public_url, raw_text, error_message, progress, processing_stage, "
+    "analysis_results(extracted_data:structured_data->data->markers, ai_insights:insights)"
+)
+
+
+def _read_cache_ttu(_key, value: Dict, now: float) -> float:
+    """Expiry time for a cached read, based on the document status it carries."""
+    ttl = COMPLETE_CACHE_TTL_SECONDS if value.get("status") == "complete" else READ_CACHE_TTL_SECONDS
+    return now + ttl
+
 
 class DatabaseManager:
     """
@@ -31,8 +80,127 @@ class DatabaseManager:
             supabase_client: Configured Supabase client instance
         """
         self.supabase = supabase_client
+        self._cache: TLRUCache = TLRUCache(maxsize=READ_CACHE_MAX_SIZE, ttu=_read_cache_ttu)
+        self._list_cache: TTLCache = TTLCache(maxsize=LIST_CACHE_MAX_SIZE, ttl=LIST_CACHE_TTL_SECONDS)
+        # Last (stage, progress) written per in-flight document, to skip repeated writes
+        self._last_stage: Dict[str, Tuple[str, int]] = {}
+        # Write generation per document, kept only while reads of it are in flight: a
+        # read that overlapped a write is returned but not cached (it may predate the write)
+        self._generations: Dict[str, int] = {}
+        self._readers: Dict[str, int] = {}
+        self._list_generation = 0
+        # Set (and replaced) whenever a document is written, to wake its SSE streams;
+        # entries only exist while a stream is waiting on the document
+        self._change_events: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+    
+    async def _execute(self, query: Any) -> Any:
+        """
+        Execute a supabase query builder without blocking the event loop.
+        
+        Args:
+            query: Built PostgREST/RPC request exposing a blocking `execute()`
+            
+        Returns:
+            The supabase API response
+        """
+        return await asyncio.to_thread(query.execute)
+    
+    async def _cached_read(
+        self, kind: str, document_id: str, loader: Callable[[], Awaitable[Optional[Dict]]]
+    ) -> Optional[Dict]:
+        """
+        Return a cached read for a document, loading and caching it on a miss.
+        
+        Misses (None) are not cached, so a failed or empty read is retried next time.
+        Neither is a read the document was written during, so it cannot outlive the write.
+        
+        Args:
+            kind: Read type, part of the cache key ("document" or "analysis")
+            document_id: ID of the document
+            loader: Performs the actual database read
+            
+        Returns:
+            Optional[Dict]: Cached or freshly loaded data
+        """
+        key = (kind, document_id)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        
+        generation = self._generations.setdefault(document_id, 0)
+        self._readers[document_id] = self._readers.get(document_id, 0) + 1
+        try:
+            value = await loader()
+        finally:
+            unchanged = self._generations[document_id] == generation
+            self._readers[document_id] -= 1
+            if not self._readers[document_id]:
+                del self._readers[document_id]
+                del self._generations[document_id]
+        
+        if value is not None and unchanged:
+            self._cache[key] = value
+        return value
+    
+    def _invalidate(self, document_id: str) -> None:
+        """
+        Drop cached reads (including list pages) and the last written stage for a
+        document after it has been modified.
+        
+        Args:
+            document_id: ID of the modified document
+        """
+        self._cache.pop(("document", document_id), None)
+        self._cache.pop(("analysis", document_id), None)
+        self._last_stage.pop(document_id, None)
+        if document_id in self._generations:
+            self._generations[document_id] += 1
+        self._clear_list_cache()
+        
+        event = self._change_events.pop(document_id, None)
+        if event is not None:
+            event.set()
+    
+    def _clear_list_cache(self) -> None:
+        """Drop cached list pages, including any page being loaded right now."""
+        self._list_cache.clear()
+        self._list_generation += 1
     
-    def create_document_record(self, document_id: str, filename: str, storage_path: str, public_url: str) -> None:
+    async def wait_for_change(self, document_id: str, timeout: float) -> bool:
+        """
+        Wait until this process writes the document, or until `timeout` elapses.
+        
+        Lets status streams push each stage as it is written instead of polling.
+        Writes made by other processes are only seen after the timeout.
+        
+        Args:
+            document_id: ID of the document to watch
+            timeout: Maximum seconds to wait
+            
+        Returns:
+            bool: True if the document was written, False on timeout
+        """
+        event = self._change_events.get(document_id)
+        if event is None:
+            event = self._change_events[document_id] = asyncio.Event()
+        self._waiters[document_id] = self._waiters.get(document_id, 0) + 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters[document_id] -= 1
+            if not self._waiters[document_id]:
+                del self._waiters[document_id]
+                # A write may already have replaced the event with nobody waiting on it
+                self._change_events.pop(document_id, None)
+    
+    async def create_document_record(
+        self, document_id: str, filename: str, storage_path: str, public_url: str,
+        idempotency_key: Optional[str] = None
+    ) -> None:
         """
         Create initial document record in database.
         
@@ -41,59 +209,99 @@ class DatabaseManager:
             filename: Original name of the uploaded file
             storage_path: Path where the file is stored
             public_url: Public URL to access the file
+            idempotency_key: Client-supplied upload key (unique), if any
             
         Raises:
             Exception: If database operation fails
         """
         try:
+            # upload_date is left to the column default (now()) on the database side
             document_data = {
                 "id": document_id,
                 "filename": filename,
                 "status": "processing",
                 "storage_path": storage_path,
-                "public_url": public_url,
-                "upload_date": datetime.now().isoformat()
+                "public_url": public_url
             }
-            self.supabase.table("documents").insert(document_data).execute()
+            if idempotency_key:
+                document_data["idempotency_key"] = idempotency_key
+            await self._execute(self.supabase.table("documents").insert(document_data, returning=NO_RETURN))
+            self._clear_list_cache()
             logger.info(f"Created initial record for document {document_id}")
         except Exception as e:
             logger.error(f"Error creating document record {document_id}: {e}", exc_info=True)
             raise
     
-    def update_processing_stage(self, document_id: str, stage: str, extra_data: Optional[Dict] = None) -> None:
+    async def create_document_records(self, records: List[Dict]) -> None:
+        """
+        Create initial records for several documents in one insert.
+        
+        Args:
+            records: Dicts with id, filename, storage_path and public_url
+            
+        Raises:
+            Exception: If database operation fails
+        """
+        try:
+            rows = [{**record, "status": "processing"} for record in records]
+            await self._execute(self.supabase.table("documents").insert(rows, returning=NO_RETURN))
+            self._clear_list_cache()
+            logger.info(f"Created initial records for {len(rows)} documents")
+        except Exception as e:
+            logger.error(f"Error creating {len(records)} document records: {e}", exc_info=True)
+            raise
+    
+    async def find_document_by_idempotency_key(self, idempotency_key: str) -> Optional[str]:
+        """
+        Look up the document created by an earlier upload with the same idempotency key.
+        
+        Args:
+            idempotency_key: Client-supplied upload key
+            
+        Returns:
+            Optional[str]: ID of the existing document, or None
+        """
+        result = await self._execute(
+            self.supabase.table("documents").select("id").eq("idempotency_key", idempotency_key).limit(1)
+        )
+        return result.data[0]["id"] if result.data else None
+    
+    async def update_processing_stage(self, document_id: str, stage: str, extra_data: Optional[Dict] = None) -> None:
         """
         Update document processing stage and progress.
         
+        A plain progress update identical to the last one written for the document is
+        skipped, so retries and restarts do not re-send (and re-broadcast) the same row.
+        
         Args:
             document_id: ID of the document being processed
             stage: Current processing stage
             extra_data: Additional data to save with the update
         """
         try:
-            # Determine progress based on stage
-            stage_progress = {
-                "ocr_extraction": 10,
-                "ai_analysis": 50,
-                "saving_results": 90,
-                "complete": 100
-            }
-            
             update_data = {
                 "processing_stage": stage,
-                "progress": stage_progress.get(stage, 0)
+                "progress": STAGE_PROGRESS.get(stage, 0)
             }
             
             # Add extra data if provided
             if extra_data:
                 update_data.update(extra_data)
             
-            self.supabase.table("documents").update(update_data).eq("id", document_id).execute()
+            stage_key = (stage, update_data["progress"])
+            if update_data.keys() == {"processing_stage", "progress"} and self._last_stage.get(document_id) == stage_key:
+                logger.debug(f"Skipping unchanged processing stage for {document_id}: {stage}")
+                return
+            
+            await self._execute(self.supabase.table("documents").update(update_data, returning=NO_RETURN).eq("id", document_id))
+            self._invalidate(document_id)
+            self._last_stage[document_id] = stage_key
             logger.info(f"Updated processing stage for {document_id}: {stage}")
         except Exception as e:
             logger.error(f"Error updating processing stage for {document_id}: {e}", exc_info=True)
             raise
     
-    def mark_document_error(self, document_id: str, error_message: str) -> None:
+    async def mark_document_error(self, document_id: str, error_message: str) -> None:
         """
         Mark document as failed with error message.
         
@@ -102,32 +310,17 @@ class DatabaseManager:
             error_message: Error description
         """
         try:
-            self.supabase.table("documents").update({
+            await self._execute(self.supabase.table("documents").update({
                 "status": "error", 
                 "error_message": str(error_message)
-            }).eq("id", document_id).execute()
+            }, returning=NO_RETURN).eq("id", document_id))
+            self._invalidate(document_id)
             logger.info(f"Marked document {document_id} as error: {error_message}")
         except Exception as e:
             logger.error(f"Error marking document {document_id} as failed: {e}", exc_info=True)
             raise
     
-    def update_document_raw_text(self, document_id: str, raw_text: str) -> None:
-        """
-        Update the raw_text field for a document.
-        
-        Args:
-            document_id: ID of the document to update
-            raw_text: The extracted raw text to save
-        """
-        try:
-            self.supabase.table("documents").update({"raw_text": raw_text}).eq("id", document_id).execute()
-            logger.info(f"Updated raw_text for document {document_id}")
-        except Exception as e:
-            logger.error(f"Error updating raw_text for {document_id}: {e}", exc_info=True)
-            # We don't re-raise here as this is not a critical failure
-            pass
-
-    def update_document_table(self, document_id: str, data: Dict) -> None:
+    async def update_document_table(self, document_id: str, data: Dict) -> None:
         """
         Update main documents table with processing status and metadata.
         
@@ -144,135 +337,118 @@ class DatabaseManager:
 
         # Set processed timestamp for completed documents
         if data["status"] == "complete":
-            doc_payload["processed_at"] = datetime.now().isoformat()
+            doc_payload["processed_at"] = datetime.now(timezone.utc).isoformat()
 
-        self.supabase.table("documents").update(doc_payload).eq("id", document_id).execute()
+        await self._execute(self.supabase.table("documents").update(doc_payload, returning=NO_RETURN).eq("id", document_id))
+        self._invalidate(document_id)
         logger.info(f"Updated document table for {document_id}")
     
-    def save_analysis_results(self, document_id: str, analysis_data: Dict) -> None:
+    async def finalize_document(self, document_id: str, analysis_data: Dict, insights_markdown: str) -> None:
         """
-        Save structured analysis results and health markers to database.
+        Save the analysis results and mark the document complete in one round-trip.
+        
+        Uses the `finalize_document` database function, which runs `save_analysis_rpc`
+        (copies the document's raw_text, upserts the analysis result and its health
+        markers) and sets status/progress/processed_at in the same transaction.
         
         Args:
             document_id: ID of the document
             analysis_data: Structured analysis data to save
+            insights_markdown: Rendered insights report (see report_formatter)
         """
-        # Get the raw_text from documents table to include it in analysis_results
-        doc_result = self.supabase.table("documents").select("raw_text").eq("id", document_id).maybe_single().execute()
-        raw_text = doc_result.data.get("raw_text") if doc_result.data else None
+        result = await self._execute(self.supabase.rpc("finalize_document", {
+            "p_document_id": document_id,
+            "p_structured_data": analysis_data,
+            "p_insights": insights_markdown
+        }))
+        self._invalidate(document_id)
         
-        # Save analysis result record
-        analysis_payload = {
-            "document_id": document_id,
-            "raw_text": raw_text,
-            "structured_data": analysis_data,
-            "insights": self._format_insights_as_markdown(HealthInsights(**analysis_data))
-        }
-        
-        analysis_result = self.supabase.table("analysis_results").upsert(
-            analysis_payload, on_conflict="document_id"
-        ).execute()
-        analysis_id = analysis_result.data[0]['id']
-
-        # Save health markers if available
-        markers = analysis_data.get("data", {}).get("markers", [])
-        if markers:
-            self._save_health_markers(analysis_id, markers)
+        marker_count = len(analysis_data.get("data", {}).get("markers", []))
+        logger.info(f"Saved analysis {result.data} with {marker_count} health markers and completed document {document_id}")
     
-    def _save_health_markers(self, analysis_id: str, markers: List[Dict]) -> None:
+    async def load_document_data(self, document_id: str) -> Optional[Dict]:
         """
-        Save health markers for an analysis result.
+        Load document metadata from database (served from the short-lived read cache).
         
-        Args:
-            analysis_id: ID of the analysis result
-            markers: List of health markers to save
-        """
-        # Clear existing markers to prevent duplicates
-        self.supabase.table("health_markers").delete().eq("analysis_id", analysis_id).execute()
-        
-        # Insert new markers
-        markers_payload = [
-            {
-                "analysis_id": analysis_id,
-                "marker_name": marker.get("marker"),
-                "value": marker.get("value"),
-                "unit": marker.get("unit"),
-                "reference_range": marker.get("reference_range"),
-            } for marker in markers
-        ]
-        self.supabase.table("health_markers").insert(markers_payload).execute()
-        logger.info(f"Saved {len(markers_payload)} health markers for analysis {analysis_id}")
-    
-    async def delete_analysis_data(self, document_id: str) -> None:
-        """
-        Delete analysis results and associated health markers.
-        
-        Args:
-            document_id: ID of the document
-        """
-        analysis_result = self.supabase.table("analysis_results").select("id").eq(
-            "document_id", document_id
-        ).maybe_single().execute()
-        
-        if analysis_result.data:
-            analysis_id = analysis_result.data["id"]
-            
-            # Delete markers first (foreign key constraint)
-            self.supabase.table("health_markers").delete().eq("analysis_id", analysis_id).execute()
-            logger.info(f"Deleted health markers for analysis {analysis_id}")
-            
-            # Delete analysis result
-            self.supabase.table("analysis_results").delete().eq("id", analysis_id).execute()
-            logger.info(f"Deleted analysis result {analysis_id}")
-    
-    def load_document_data(self, document_id: str) -> Optional[Dict]:
-        """
-        Load document data from database.
+        Only DOCUMENT_METADATA_COLUMNS are fetched; use get_analysis for the full
+        document including raw_text and analysis results.
         
         Args:
             document_id: ID of the document to load
             
         Returns:
-            Optional[Dict]: Document data or None if not found
+            Optional[Dict]: Document metadata or None if not found
         """
         try:
-            result = self.supabase.table("documents").select("*").eq("id", document_id).maybe_single().execute()
-            return result.data
+            return await self._cached_read("document", document_id, lambda: self._fetch_document(document_id))
         except Exception as e:
             logger.error(f"Error loading document data for {document_id}: {e}", exc_info=True)
             return None
     
-    def delete_document_record(self, document_id: str) -> None:
+    async def delete_document_record(self, document_id: str) -> None:
         """
         Delete main document record from database.
         
+        Its analysis_results and health_markers rows are removed by ON DELETE CASCADE.
+        
         Args:
             document_id: ID of the document to delete
         """
-        self.supabase.table("documents").delete().eq("id", document_id).execute()
+        await self._execute(self.supabase.table("documents").delete(returning=NO_RETURN).eq("id", document_id))
+        self._invalidate(document_id)
         logger.info(f"Deleted document record {document_id}")
     
-    async def list_documents(self) -> List[Dict]:
+    async def list_documents(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
         """
-        Retrieve all documents with their analysis data.
+        Retrieve documents (newest first) with their list-view fields.
+        
+        Reads from `documents_list_view`, which carries a marker count instead of the
+        full structured data and insights; those are fetched per document via get_analysis.
+        Pages are cached briefly and dropped whenever a document is written.
+        
+        Args:
+            limit: Maximum number of documents to return (all when None)
+            offset: Number of documents to skip, for paging with `limit`
         
         Returns:
-            List[Dict]: List of formatted document data for frontend
+            List[Dict]: List of formatted document summaries for frontend
         """
+        key = (limit, offset)
+        cached = self._list_cache.get(key)
+        if cached is not None:
+            return cached
+        
         try:
-            # Get documents with joined analysis data
-            result = self.supabase.table("documents").select(
-                "*, analysis_results(structured_data, insights)"
-            ).order("upload_date", desc=True).execute()
+            query = self.supabase.table("documents_list_view").select(DOCUMENT_LIST_COLUMNS).order("upload_date", desc=True)
+            if limit is not None:
+                query = query.range(offset, offset + limit - 1)
             
-            return [self._format_document_for_frontend(doc) for doc in result.data]
+            generation = self._list_generation
+            result = await self._execute(query)
+            
+            if self._list_generation == generation:
+                self._list_cache[key] = result.data
+            return result.data
         except Exception as e:
             logger.error(f"Error listing documents: {e}", exc_info=True)
             raise
     
-    def get_analysis(self, document_id: str) -> Optional[Dict]:
+    async def list_processing_documents(self) -> List[Dict]:
         """
-        Get analysis results for a specific document.
+        Retrieve documents still marked as processing, oldest first.
+        
+        Returns:
+            List[Dict]: Metadata of documents whose pipeline has not finished
+        """
+        result = await self._execute(
+            self.supabase.table("documents").select(DOCUMENT_METADATA_COLUMNS)
+            .eq("status", "processing").order("upload_date")
+        )
+        return result.data
+    
+    async def get_analysis(self, document_id: str) -> Optional[Dict]:
+        """
+        Get analysis results for a specific document (served from the short-lived read cache).
         
         Args:
             document_id: ID of the document
@@ -281,79 +457,95 @@ class DatabaseManager:
             Optional[Dict]: Formatted analysis data or None if not found
         """
         try:
-            # Get document with analysis data
-            result = self.supabase.table("documents").select(
-                "*, analysis_results(structured_data, insights)"
-            ).eq("id", document_id).maybe_single().execute()
-            
-            if not result.data:
-                return None
-            
-            return self._format_document_for_frontend(result.data)
+            return await self._cached_read("analysis", document_id, lambda: self._fetch_analysis(document_id))
         except Exception as e:
             logger.error(f"Error getting analysis for {document_id}: {e}", exc_info=True)
             return None
     
-    def _format_insights_as_markdown(self, insights: HealthInsights) -> str:
+    async def get_llm_response(self, key: str, max_age: timedelta) -> Optional[Dict]:
+        """
+        Load a stored LLM response if it is younger than `max_age`.
+        
+        Args:
+            key: Cache key of the request (see LLMResponseCache)
+            max_age: Oldest response still considered valid
+            
+        Returns:
+            Optional[Dict]: The stored response, or None on a miss
+        """
+        cutoff = (datetime.now(timezone.utc) - max_age).isoformat()
+        result = await self._execute(
+            self.supabase.table("llm_cache").select("response").eq("key", key).gte("created_at", cutoff).limit(1)
+        )
+        return result.data[0]["response"] if result.data else None
+    
+    async def save_llm_response(self, key: str, response: Dict) -> None:
+        """
+        Store (or refresh) an LLM response under its cache key.
+        
+        Args:
+            key: Cache key of the request
+            response: JSON-serializable response to store
+        """
+        await self._execute(self.supabase.table("llm_cache").upsert({
+            "key": key,
+            "response": response,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }, returning=NO_RETURN))
+    
+    async def _fetch_document(self, document_id: str) -> Optional[Dict]:
+        """
+        Fetch the metadata columns of a document row.
+        
+        Args:
+            document_id: ID of the document
+            
+        Returns:
+            Optional[Dict]: Document metadata or None if not found
+        """
+        result = await self._execute(
+            self.supabase.table("documents").select(DOCUMENT_METADATA_COLUMNS).eq("id", document_id).maybe_single()
+        )
+        return result.data
+    
+    async def _fetch_analysis(self, document_id: str) -> Optional[Dict]:
         """
-        Convert structured insights to markdown format for frontend display.
+        Fetch a document with its analysis data and format it for the frontend.
         
         Args:
-            insights: Structured health insights
+            document_id: ID of the document
             
         Returns:
-            str: Formatted markdown string
+            Optional[Dict]: Formatted analysis data or None if not found
         """
-        md = f"# Analysis Report\n\n## Summary\n{insights.summary}\n\n"
-        md += "## Key Findings\n" + "".join([f"- {finding}\n" for finding in insights.key_findings])
-        md += "\n## Recommendations\n" + "".join([f"- {rec}\n" for rec in insights.recommendations])
-        md += f"\n---\n\n**Disclaimer:** {insights.disclaimer}"
-        return md
+        # Get document with its markers and insights
+        result = await self._execute(
+            self.supabase.table("documents").select(DOCUMENT_DETAIL_COLUMNS).eq("id", document_id).maybe_single()
+        )
+        
+        if not result.data:
+            return None
+        
+        return self._format_document_for_frontend(result.data)
     
     def _format_document_for_frontend(self, doc: Dict) -> Dict:
         """
-        Format document data for frontend consumption.
+        Flatten the embedded analysis of a DOCUMENT_DETAIL_COLUMNS row.
         
         Args:
-            doc: Raw document data from database
+            doc: Document row selected with DOCUMENT_DETAIL_COLUMNS
             
         Returns:
             Dict: Formatted document data
         """
-        analysis_results = doc.get("analysis_results")
-        analysis = None
+        analysis = doc.pop("analysis_results", None)
         
-        # Handle both list (one-to-many) and dict (one-to-one) from Supabase join
-        if isinstance(analysis_results, list) and len(analysis_results) > 0:
-            analysis = analysis_results[0]
-        elif isinstance(analysis_results, dict):
-            analysis = analysis_results
-
-        extracted_data = []
-        ai_insights = None
+        # One-to-one embeds come back as an object; handle a list as well in case the
+        # relationship is reported as one-to-many
+        if isinstance(analysis, list):
+            analysis = analysis[0] if analysis else None
+        analysis = analysis or {}
         
-        if analysis:
-            structured_data = analysis.get("structured_data")
-            ai_insights = analysis.get("insights")
-            
-            # Safely extract markers for the frontend
-            if isinstance(structured_data, dict) and "data" in structured_data:
-                # Ensure we handle potential missing 'markers' key gracefully
-                if isinstance(structured_data["data"], dict):
-                    extracted_data = structured_data["data"].get("markers", [])
-        
-        return {
-            "id": doc.get("id"),
-            "document_id": doc.get("id"),
-            "filename": doc.get("filename"),
-            "uploaded_at": doc.get("upload_date"),
-            "status": doc.get("status"),
-            "processed_at": doc.get("processed_at"),
-            "public_url": doc.get("public_url"),
-            "raw_text": doc.get("raw_text"),
-            "extracted_data": extracted_data,
-            "ai_insights": ai_insights,
-            "error_message": doc.get("error_message"),
-            "progress": doc.get("progress"),
-            "processing_stage": doc.get("processing_stage")
-        }
\ No newline at end of file
+        doc["extracted_data"] = analysis.get("extracted_data") or []
+        doc["ai_insights"] = analysis.get("ai_insights")
+        return doc
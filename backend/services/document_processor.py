@@ -9,18 +9,46 @@ import asyncio
 import uuid
 import os
 import logging
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
 
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 
 from config.settings import settings
 from services.storage_manager import StorageManager
 from services.database_manager import DatabaseManager
 from services.processing_pipeline import ProcessingPipeline
+from services.concurrency import retry_with_backoff
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=1)
+def _get_supabase() -> Client:
+    """
+    Return the process-wide Supabase client, creating it on first use.
+    
+    The client's PostgREST and storage sessions (HTTP/2, pooled) are shared by
+    every DocumentProcessor and its managers instead of being rebuilt per instance.
+    """
+    options = ClientOptions(
+        postgrest_client_timeout=settings.SUPABASE_POSTGREST_TIMEOUT,
+        storage_client_timeout=settings.SUPABASE_STORAGE_TIMEOUT
+    )
+    return create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY, options=options)
+
+
+def _close_supabase() -> None:
+    """Close the shared client's HTTP connection pools, if the client was created."""
+    if _get_supabase.cache_info().currsize == 0:
+        return
+    
+    client = _get_supabase()
+    client.postgrest.aclose()
+    client.storage.aclose()
+    _get_supabase.cache_clear()
+
+
 class DocumentProcessor:
     """
     Main service for processing health documents through OCR and AI analysis pipeline.
@@ -35,8 +63,8 @@ class DocumentProcessor:
     
     def __init__(self):
         """Initialize the document processor with required managers."""
-        # Initialize Supabase client
-        self.supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+        # Shared Supabase client
+        self.supabase: Client = _get_supabase()
         
         # Initialize specialized managers
         self.storage_manager = StorageManager(self.supabase)
@@ -45,13 +73,25 @@ class DocumentProcessor:
     
     # === PUBLIC API METHODS ===
     
-    async def process_document(self, file_content: bytes, filename: str) -> str:
+    async def close(self) -> None:
+        """Release the agents' and the shared Supabase connections (called on application shutdown)."""
+        await self.processing_pipeline.close()
+        _close_supabase()
+        logger.info("Closed AI agent and Supabase client connections")
+    
+    async def process_document(
+        self, file: Union[bytes, BinaryIO], filename: str, idempotency_key: Optional[str] = None
+    ) -> str:
         """
         Process a document and return document ID for tracking.
         
+        A replayed upload carrying the same idempotency key returns the document
+        created by the first request instead of storing and processing it again.
+        
         Args:
-            file_content: Binary content of the uploaded file
+            file: Uploaded file content, or a binary file object streamed to storage
             filename: Original filename from upload
+            idempotency_key: Client-supplied key identifying this upload, if any
             
         Returns:
             str: Document ID for tracking processing status
@@ -59,36 +99,95 @@ class DocumentProcessor:
         Raises:
             Exception: If upload or initial processing fails
         """
+        if idempotency_key:
+            existing_id = await self.database_manager.find_document_by_idempotency_key(idempotency_key)
+            if existing_id:
+                logger.info(f"Upload replayed with idempotency key, returning document {existing_id}")
+                return existing_id
+        
         document_id = str(uuid.uuid4())
         file_extension = os.path.splitext(filename)[1]
         storage_path = f"{document_id}{file_extension}"
 
         try:
             # Upload to storage and create initial record
-            public_url = self.storage_manager.upload_file(file_content, storage_path)
-            self.database_manager.create_document_record(document_id, filename, storage_path, public_url)
+            public_url = await self.storage_manager.upload_file(file, storage_path)
+            try:
+                await self.database_manager.create_document_record(
+                    document_id, filename, storage_path, public_url, idempotency_key
+                )
+            except Exception:
+                # A concurrent request with the same key won the unique index: keep its document
+                existing_id = idempotency_key and await self.database_manager.find_document_by_idempotency_key(idempotency_key)
+                if not existing_id:
+                    raise
+                await self.storage_manager.delete_files([storage_path])
+                return existing_id
 
-            # Start async processing pipeline
-            asyncio.create_task(
-                self.processing_pipeline.process_document_async(document_id, public_url, filename)
-            )
+            # Queue the async processing pipeline
+            self.processing_pipeline.schedule(document_id, public_url, filename)
             
             logger.info(f"Document {document_id} queued for processing")
             return document_id
             
         except Exception as e:
             logger.error(f"Document processing error for {document_id}: {e}", exc_info=True)
-            self.database_manager.mark_document_error(document_id, str(e))
+            await self.database_manager.mark_document_error(document_id, str(e))
+            raise
+    
+    async def process_documents(self, files: List[Tuple[Union[bytes, BinaryIO], str]]) -> List[str]:
+        """
+        Process several documents uploaded together and return their IDs.
+        
+        Uploads all files concurrently, creates every record in a single insert,
+        then queues one pipeline task per document.
+        
+        Args:
+            files: (file, filename) pairs from the upload; file is bytes or a binary file object
+            
+        Returns:
+            List[str]: Document IDs, in the same order as `files`
+            
+        Raises:
+            Exception: If any upload or the record insert fails (nothing is queued)
+        """
+        records = []
+        for _, filename in files:
+            document_id = str(uuid.uuid4())
+            records.append({
+                "id": document_id,
+                "filename": filename,
+                "storage_path": f"{document_id}{os.path.splitext(filename)[1]}"
+            })
+        
+        try:
+            public_urls = await self.storage_manager.upload_files(
+                [(file, record["storage_path"]) for (file, _), record in zip(files, records)]
+            )
+            for record, public_url in zip(records, public_urls):
+                record["public_url"] = public_url
+            await self.database_manager.create_document_records(records)
+        except Exception as e:
+            logger.error(f"Batch processing error for {len(files)} documents: {e}", exc_info=True)
             raise
+        
+        for record in records:
+            self.processing_pipeline.schedule(record["id"], record["public_url"], record["filename"])
+        
+        logger.info(f"{len(records)} documents queued for processing")
+        return [record["id"] for record in records]
     
     async def delete_document(self, document_id: str) -> bool:
         """
         Delete a document and all associated data with improved error handling.
         
+        The storage file and the document record are removed concurrently. Analysis
+        results and health markers are removed with the record by the database
+        (ON DELETE CASCADE), so no separate cleanup query is needed.
+        
         Implements a resilient deletion process that handles various failure scenarios:
-        - Partial deletion recovery
-        - Storage file cleanup retries
-        - Database constraint handling
+        - Storage file cleanup retries (non-critical, logged on failure)
+        - Document record deletion retries with exponential backoff
         - Detailed error logging
         
         Args:
@@ -97,73 +196,71 @@ class DocumentProcessor:
         Returns:
             bool: True if deletion successful, False if document not found or deletion failed
         """
-        max_retries = 3
-        retry_delay = 1.0
+        try:
+            document_data = await self.database_manager.load_document_data(document_id)
+            if not document_data:
+                logger.warning(f"Document {document_id} not found for deletion")
+                return False
+            
+            record_deleted, _ = await asyncio.gather(
+                self._delete_document_record_with_retry(document_id),
+                self._delete_storage_file(document_id, document_data.get("storage_path"))
+            )
+            return record_deleted
+            
+        except Exception as e:
+            logger.error(f"Unexpected error during deletion of document {document_id}: {e}", exc_info=True)
+            return False
+    
+    async def _delete_document_record_with_retry(self, document_id: str, max_retries: int = 3) -> bool:
+        """
+        Delete the document record (cascading to its analysis data), retrying on failure.
         
-        for attempt in range(max_retries):
-            try:
-                document_data = self.database_manager.load_document_data(document_id)
-                if not document_data:
-                    logger.warning(f"Document {document_id} not found for deletion")
-                    return False
-
-                logger.info(f"Starting deletion attempt {attempt + 1}/{max_retries} for document {document_id}")
-
-                # Step 1: Delete analysis data (handles foreign key constraints)
-                try:
-                    await self.database_manager.delete_analysis_data(document_id)
-                    logger.info(f"Successfully deleted analysis data for document {document_id}")
-                except Exception as e:
-                    logger.warning(f"Analysis data deletion failed for {document_id}: {e}")
-                    if attempt == max_retries - 1:
-                        # If this is the last attempt, continue anyway as analysis data might not exist
-                        logger.info(f"Continuing deletion despite analysis data error on final attempt")
-
-                # Step 2: Delete storage file (with retry logic)
-                storage_path = document_data.get("storage_path")
-                if storage_path:
-                    try:
-                        await self.storage_manager.delete_file_with_retry(storage_path)
-                        logger.info(f"Successfully deleted storage file for document {document_id}")
-                    except Exception as e:
-                        logger.warning(f"Storage file deletion failed for {document_id}: {e}")
-                        if attempt == max_retries - 1:
-                            # Continue with document record deletion even if storage file fails
-                            logger.warning(f"Continuing deletion despite storage file error on final attempt")
-
-                # Step 3: Delete document record (most critical step)
-                try:
-                    self.database_manager.delete_document_record(document_id)
-                    logger.info(f"Successfully deleted document record for {document_id}")
-                    
-                    # If we reach here, deletion was successful
-                    logger.info(f"Successfully deleted document {document_id} on attempt {attempt + 1}")
-                    return True
-                    
-                except Exception as e:
-                    logger.error(f"Critical: Document record deletion failed for {document_id}: {e}")
-                    if attempt < max_retries - 1:
-                        logger.info(f"Retrying deletion in {retry_delay} seconds...")
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                        continue
-                    else:
-                        # Final attempt failed
-                        logger.error(f"All deletion attempts failed for document {document_id}")
-                        return False
-
-            except Exception as e:
-                logger.error(f"Unexpected error during deletion attempt {attempt + 1} for document {document_id}: {e}", exc_info=True)
-                if attempt < max_retries - 1:
-                    logger.info(f"Retrying deletion in {retry_delay} seconds...")
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 2
-                    continue
-                else:
-                    logger.error(f"All deletion attempts failed for document {document_id}")
-                    return False
-
-        return False
+        Args:
+            document_id: ID of document to delete
+            max_retries: Maximum number of attempts
+            
+        Returns:
+            bool: True if the record was deleted, False if all attempts failed
+        """
+        try:
+            await retry_with_backoff(
+                f"Document record deletion for {document_id}",
+                lambda: self.database_manager.delete_document_record(document_id),
+                max_attempts=max_retries
+            )
+        except Exception as e:
+            logger.error(f"All deletion attempts failed for document {document_id}: {e}")
+            return False
+        
+        logger.info(f"Successfully deleted document {document_id}")
+        return True
+    
+    async def _delete_storage_file(self, document_id: str, storage_path: Optional[str]) -> None:
+        """
+        Delete the document's storage file; failures are logged, not raised.
+        
+        Args:
+            document_id: ID of the document (for logging)
+            storage_path: Path of the file in storage, if any
+        """
+        if not storage_path:
+            return
+        
+        try:
+            await self.storage_manager.delete_file_with_retry(storage_path)
+            logger.info(f"Successfully deleted storage file for document {document_id}")
+        except Exception as e:
+            logger.warning(f"Storage file deletion failed for {document_id}: {e}")
+    
+    async def resume_interrupted_documents(self) -> int:
+        """
+        Re-queue documents whose processing was cut short by a restart (called on startup).
+        
+        Returns:
+            int: Number of documents re-queued
+        """
+        return await self.processing_pipeline.resume_interrupted()
     
     async def retry_document_processing(self, document_id: str) -> bool:
         """
@@ -177,20 +274,24 @@ class DocumentProcessor:
         """
         return await self.processing_pipeline.retry_processing(document_id)
     
-    async def list_documents(self) -> List[Dict]:
+    async def list_documents(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
         """
-        List all processed documents.
+        List processed documents, newest first.
+        
+        Args:
+            limit: Maximum number of documents to return (all when None)
+            offset: Number of documents to skip, for paging with `limit`
         
         Returns:
             List[Dict]: Array of document data formatted for frontend
         """
         try:
-            return await self.database_manager.list_documents()
+            return await self.database_manager.list_documents(limit, offset)
         except Exception as e:
             logger.error(f"List documents error: {str(e)}")
             raise
     
-    def get_analysis(self, document_id: str) -> Optional[Dict]:
+    async def get_analysis(self, document_id: str) -> Optional[Dict]:
         """
         Get a specific document by ID with analysis results.
         
@@ -201,7 +302,20 @@ class DocumentProcessor:
             Optional[Dict]: Document analysis data or None if not found
         """
         try:
-            return self.database_manager.get_analysis(document_id)
+            return await self.database_manager.get_analysis(document_id)
         except Exception as e:
             logger.error(f"Get document error: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+    
+    async def wait_for_update(self, document_id: str, timeout: float) -> bool:
+        """
+        Wait for the next status/progress write to a document (used by the SSE stream).
+        
+        Args:
+            document_id: ID of the document to watch
+            timeout: Maximum seconds to wait
+            
+        Returns:
+            bool: True if the document was updated, False on timeout
+        """
+        return await self.database_manager.wait_for_change(document_id, timeout)
\ No newline at end of file
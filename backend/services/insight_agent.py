@@ -1,14 +1,41 @@
 # backend/services/insight_agent.py
+import asyncio
+from functools import partial
 import logging
+import orjson
 import httpx
 from config.settings import settings
 from models.health_models import HealthInsights, HealthDataExtraction
 from services.json_utils import safe_json_parse
+from services.concurrency import CircuitBreaker, RequestCoalescer, retry_on_rate_limit
+from services.llm_cache import LLMResponseCache
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+_SYSTEM_PROMPT = """\
+You are a highly specialized medical analysis AI trained in interpreting laboratory results. You have expert-level knowledge of clinical medicine, diagnostics, pathology, and laboratory reference ranges. You will receive structured JSON data from a lab report. Your task is to generate a high-level summary, key findings, and general recommendations based ONLY on the provided data.
+
+Your response MUST be a JSON object with this exact structure:
+{
+    "summary": "Brief, high-level summary of the findings.",
+    "key_findings": ["A bulleted list of the most important findings.", "Another key finding."],
+    "recommendations": ["A bulleted list of general, non-prescriptive recommendations.", "Another recommendation."],
+    "disclaimer": "This analysis is for educational purposes only. It is not a substitute for professional medical advice. Always consult a qualified healthcare provider."
+}
+
+**ANALYSIS RULES:**
+1.  **Analyze Abnormalities:** Review the `markers`. For each marker, compare its `value` to its `reference_range` to identify high or low values.
+2.  **Generate Summary:** Write a 2-3 sentence summary of the overall results.
+3.  **Create Key Findings:** Create a bullet point for each abnormal marker. If all markers are normal, state that clearly as the key finding.
+    - Example (Abnormal): "The Creatinine level (1.4 mg/dL) is slightly elevated above the reference range (0.70 - 1.30 mg/dL)."
+4.  **Provide Recommendations:** For each finding about an abnormal value, provide a sensible, non-prescriptive recommendation.
+    - Example: "Discuss the elevated Creatinine level with a healthcare provider."
+"""
+_USER_PROMPT_PREFIX = "Generate insights for this structured lab data:\n\n"
+
 class InsightAgent:
-    def __init__(self):
+    def __init__(self, response_cache: Optional[LLMResponseCache] = None):
         self.client = httpx.AsyncClient(
             base_url=settings.CHUTES_AI_ENDPOINT,
             headers={
@@ -19,51 +46,55 @@ class InsightAgent:
         )
         # For insight generation, a more powerful model is often better.
         self.model = settings.CHUTES_AI_MODEL 
+        self._semaphore = asyncio.Semaphore(settings.CHUTES_AI_MAX_CONCURRENT_REQUESTS)
+        self._coalescer = RequestCoalescer("InsightAgent")
+        self._breaker = CircuitBreaker("InsightAgent")
+        self._response_cache = response_cache
 
-    async def generate_insights(self, extracted_data: HealthDataExtraction) -> HealthInsights:
+    async def generate_insights(self, extracted_data: HealthDataExtraction, refresh: bool = False) -> HealthInsights:
         logger.info(f"Generating insights with model {self.model}")
         
-        system_prompt = """
-        You are a highly specialized medical analysis AI trained in interpreting laboratory results. You have expert-level knowledge of clinical medicine, diagnostics, pathology, and laboratory reference ranges. You will receive structured JSON data from a lab report. Your task is to generate a high-level summary, key findings, and general recommendations based ONLY on the provided data.
+        # Compact JSON: indentation only costs input tokens
+        input_json_string = extracted_data.model_dump_json()
 
-        Your response MUST be a JSON object with this exact structure:
-        {
-            "summary": "Brief, high-level summary of the findings.",
-            "key_findings": ["A bulleted list of the most important findings.", "Another key finding."],
-            "recommendations": ["A bulleted list of general, non-prescriptive recommendations.", "Another recommendation."],
-            "disclaimer": "This analysis is for educational purposes only. It is not a substitute for professional medical advice. Always consult a qualified healthcare provider."
-        }
+        key = RequestCoalescer.make_key(self.model, _SYSTEM_PROMPT, input_json_string)
+        call = lambda: self._request_insights(extracted_data, input_json_string)
+        if self._response_cache is not None:
+            # Insights on an empty extraction are not worth replaying
+            call = partial(
+                self._response_cache.run, key, call, HealthInsights,
+                refresh=refresh, cacheable=lambda result: bool(result.data.markers)
+            )
+        # A refreshing retry must not join (and get back) a non-refreshed call
+        return await self._coalescer.run(RequestCoalescer.make_key(key, "refresh") if refresh else key, call)
 
-        **ANALYSIS RULES:**
-        1.  **Analyze Abnormalities:** Review the `markers`. For each marker, compare its `value` to its `reference_range` to identify high or low values.
-        2.  **Generate Summary:** Write a 2-3 sentence summary of the overall results.
-        3.  **Create Key Findings:** Create a bullet point for each abnormal marker. If all markers are normal, state that clearly as the key finding.
-            - Example (Abnormal): "The Creatinine level (1.4 mg/dL) is slightly elevated above the reference range (0.70 - 1.30 mg/dL)."
-        4.  **Provide Recommendations:** For each finding about an abnormal value, provide a sensible, non-prescriptive recommendation.
-            - Example: "Discuss the elevated Creatinine level with a healthcare provider."
-        """
-        
-        # Convert the Pydantic object back to a dict for the prompt
-        input_json_string = extracted_data.model_dump_json(indent=2)
-        
-        try:
+    async def _post_completion(self, user_content: str) -> httpx.Response:
+        async with self._semaphore:
             response = await self.client.post(
                 "/chat/completions",
                 json={
                     "model": self.model,
                     "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Generate insights for this structured lab data:\n\n{input_json_string}"}
+                        {"role": "system", "content": _SYSTEM_PROMPT},
+                        {"role": "user", "content": user_content}
                     ],
                     "response_format": {"type": "json_object"}
                 }
             )
-            response.raise_for_status()
-            content = response.json()["choices"][0]["message"]["content"]
+        response.raise_for_status()
+        return response
+
+    async def _request_insights(self, extracted_data: HealthDataExtraction, input_json_string: str) -> HealthInsights:
+        try:
+            response = await self._breaker.call(lambda: retry_on_rate_limit(
+                "InsightAgent", lambda: self._post_completion(_USER_PROMPT_PREFIX + input_json_string)
+            ))
+            content = orjson.loads(response.content)["choices"][0]["message"]["content"]
             insight_data = safe_json_parse(content)
 
-            # Combine the input data with the generated insights
-            return HealthInsights(data=extracted_data, **insight_data)
+            # Combine the input data with the generated insights. The already-validated
+            # extraction is passed as a model instance, so its markers are not re-validated.
+            return HealthInsights.model_validate({**insight_data, "data": extracted_data})
             
         except Exception as e:
             logger.error(f"Critical failure in InsightAgent: {e}", exc_info=True)
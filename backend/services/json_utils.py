@@ -3,10 +3,14 @@ JSON and Data Parsing Utilities
 
 Utility functions for safely parsing JSON and handling data transformations.
 These functions are shared across multiple agent implementations.
+
+Parsing uses orjson; its JSONDecodeError subclasses json.JSONDecodeError, so
+callers can keep catching the stdlib exception.
 """
 
 import json
 import logging
+import orjson
 import re
 from typing import Optional
 from datetime import datetime
@@ -55,14 +59,14 @@ def safe_json_parse(json_str: str) -> dict:
     """
     try:
         # First attempt: direct parsing
-        return json.loads(json_str)
+        return orjson.loads(json_str)
     except json.JSONDecodeError as e:
         logger.warning(f"Initial JSON parse failed: {e}")
         
         # Second attempt: clean and parse
         try:
             cleaned_json = clean_json_string(json_str)
-            return json.loads(cleaned_json)
+            return orjson.loads(cleaned_json)
         except json.JSONDecodeError as e2:
             logger.error(f"JSON parse failed after cleaning: {e2}")
             logger.error(f"Problematic JSON content (first 500 chars): {json_str[:500]}")
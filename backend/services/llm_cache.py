@@ -0,0 +1,106 @@
+"""
+LLM Response Cache
+
+Persists validated AI agent responses in Supabase so that re-processing the same
+document (re-uploads, retries) does not repeat the LLM calls.
+Shared by the extraction and insight agents.
+"""
+
+import logging
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Optional, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from config.settings import settings
+from services.database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class LLMResponseCache:
+    """
+    Read-through cache of LLM responses, keyed by a hash of model, prompt and input.
+
+    The agents build the key with `RequestCoalescer.make_key`, including the system
+    prompt, so changing the model or the prompt naturally misses the old entries.
+    Cache failures are logged and treated as misses: the cache never fails a document.
+    """
+
+    def __init__(self, database_manager: DatabaseManager, ttl_days: int = settings.LLM_CACHE_TTL_DAYS):
+        """
+        Initialize the cache.
+
+        Args:
+            database_manager: Database manager used to read and store responses
+            ttl_days: How long a stored response stays valid; 0 disables the cache
+        """
+        self.db_manager = database_manager
+        self.max_age = timedelta(days=ttl_days)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """
+        Return the stored response for `key`, or None on a miss or error.
+
+        Args:
+            key: Request key
+        """
+        if not self.max_age:
+            return None
+        try:
+            return await self.db_manager.get_llm_response(key, self.max_age)
+        except Exception as e:
+            logger.warning(f"LLM cache read failed, calling the model instead: {e}")
+            return None
+
+    async def set(self, key: str, response: Dict) -> None:
+        """
+        Store a response under `key`; errors are logged and ignored.
+
+        Args:
+            key: Request key
+            response: JSON-serializable response
+        """
+        if not self.max_age:
+            return
+        try:
+            await self.db_manager.save_llm_response(key, response)
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+    async def run(
+        self,
+        key: str,
+        call: Callable[[], Awaitable[M]],
+        model: Type[M],
+        refresh: bool = False,
+        cacheable: Callable[[M], bool] = lambda _: True
+    ) -> M:
+        """
+        Return the cached response for `key`, or perform `call` and cache its result.
+
+        Args:
+            key: Request key
+            call: Zero-argument coroutine factory performing the LLM request
+            model: Pydantic model the response is validated into
+            refresh: Skip the stored response and replace it with a fresh one (explicit retries)
+            cacheable: Tells whether a fresh response is worth keeping (e.g. not an empty extraction)
+
+        Returns:
+            The cached or freshly requested response
+        """
+        cached = None if refresh else await self.get(key)
+        if cached is not None:
+            try:
+                result = model.model_validate(cached)
+                logger.info(f"LLM cache hit for {model.__name__}")
+                return result
+            except ValidationError as e:
+                logger.warning(f"Ignoring invalid cached {model.__name__}: {e}")
+
+        result = await call()
+        if cacheable(result):
+            await self.set(key, result.model_dump(mode="json"))
+        return result
@@ -66,7 +66,7 @@ class MistralOCRService:
             elif "image" in mime_type:
                 document_data = {"type": "image_url", "image_url": data_url}
             else:
-                raise Exception(f"Unsupported MIME type: {mime_type}")
+                raise ValueError(f"Unsupported MIME type: {mime_type}")
 
             payload = {
                 "model": self.model,
@@ -78,7 +78,8 @@ class MistralOCRService:
             response.raise_for_status()
 
             ocr_result = response.json()
-            logger.debug(f"Mistral OCR API full response: {ocr_result}")
+            # Lazy formatting: the full OCR result is only rendered when debug logging is on
+            logger.debug("Mistral OCR API full response: %s", ocr_result)
             
             if not ocr_result.get('pages'):
                  logger.warning(f"OCR for {filename} completed but no pages were extracted.")
@@ -88,11 +89,12 @@ class MistralOCRService:
             return ocr_result
 
         except requests.exceptions.RequestException as e:
+            # Re-raised as is: the status code tells provider outages from bad requests
             logger.error(f"HTTP request failed during OCR for {filename}: {e}", exc_info=True)
-            raise Exception(f"Failed to process {filename} due to a network error: {e}")
+            raise
         except Exception as e:
             logger.error(f"An unexpected error occurred during OCR for {filename}: {e}", exc_info=True)
-            raise Exception(f"An unexpected error occurred while processing {filename}: {e}")
+            raise Exception(f"An unexpected error occurred while processing {filename}: {e}") from e
 
     def get_usage_info(self) -> Dict[str, Any]:
         """Get usage information for monitoring."""
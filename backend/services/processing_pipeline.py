@@ -7,16 +7,22 @@ and results persistence with progress tracking.
 
 import logging
 import asyncio
-from typing import Dict, Optional
+from typing import Awaitable, Dict, Optional, TypeVar
 
+from config.settings import settings
 from models.health_models import HealthInsights
 from services.database_manager import DatabaseManager
 from services.mistral_ocr_service import MistralOCRService
 from services.extraction_agent import ExtractionAgent
 from services.insight_agent import InsightAgent
+from services.llm_cache import LLMResponseCache
+from services.concurrency import CircuitBreaker, retry_on_rate_limit
+from services.report_formatter import format_insights_as_markdown
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 # Processing stages constants
 class ProcessingStage:
@@ -27,15 +33,6 @@ class ProcessingStage:
     COMPLETE = "complete"
 
 
-# Progress percentages for each stage
-STAGE_PROGRESS = {
-    ProcessingStage.OCR_EXTRACTION: 10,
-    ProcessingStage.AI_ANALYSIS: 50,
-    ProcessingStage.SAVING_RESULTS: 90,
-    ProcessingStage.COMPLETE: 100
-}
-
-
 class ProcessingPipeline:
     """
     Manages the document processing pipeline from OCR to final analysis.
@@ -53,10 +50,56 @@ class ProcessingPipeline:
         """
         self.db_manager = database_manager
         self.ocr_agent = MistralOCRService()
-        self.extraction_agent = ExtractionAgent()
-        self.insight_agent = InsightAgent()
+        self._ocr_breaker = CircuitBreaker("MistralOCR")
+        # Both agents share one Supabase-backed cache of earlier LLM responses
+        response_cache = LLMResponseCache(database_manager)
+        self.extraction_agent = ExtractionAgent(response_cache)
+        self.insight_agent = InsightAgent(response_cache)
+        
+        # Bounded scheduling: at most N pipelines run at once, the rest wait for a slot.
+        # Tasks are tracked by document ID so they are not garbage-collected mid-run
+        # and the same document is never processed twice concurrently.
+        self._slots = asyncio.Semaphore(settings.PIPELINE_MAX_CONCURRENT_DOCUMENTS)
+        self._tasks: Dict[str, asyncio.Task] = {}
+    
+    def schedule(self, document_id: str, file_url: str, filename: str, refresh: bool = False) -> bool:
+        """
+        Queue a document for background processing.
+        
+        Args:
+            document_id: Unique identifier for the document
+            file_url: URL to the document file
+            filename: Original filename for context
+            refresh: Ask the AI agents for fresh responses instead of cached ones
+            
+        Returns:
+            bool: True if queued, False if the document is already queued or processing
+        """
+        if document_id in self._tasks:
+            logger.info(f"Document {document_id} is already queued or processing")
+            return False
+        
+        task = asyncio.create_task(self._run_with_slot(document_id, file_url, filename, refresh))
+        self._tasks[document_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(document_id, None))
+        return True
+    
+    async def _run_with_slot(self, document_id: str, file_url: str, filename: str, refresh: bool) -> None:
+        """Run the pipeline for a document once a concurrency slot is free."""
+        async with self._slots:
+            try:
+                await self.process_document_async(document_id, file_url, filename, refresh)
+            except Exception:
+                # Already logged and recorded on the document by process_document_async
+                pass
     
-    async def process_document_async(self, document_id: str, file_url: str, filename: str) -> None:
+    async def close(self) -> None:
+        """Close the AI agents' HTTP clients (called on application shutdown)."""
+        await asyncio.gather(self.extraction_agent.close(), self.insight_agent.close())
+    
+    async def process_document_async(
+        self, document_id: str, file_url: str, filename: str, refresh: bool = False
+    ) -> None:
         """
         Process document through complete pipeline asynchronously.
         
@@ -70,6 +113,7 @@ class ProcessingPipeline:
             document_id: Unique identifier for the document
             file_url: URL to the document file
             filename: Original filename for context
+            refresh: Ask the AI agents for fresh responses instead of cached ones
         """
         try:
             logger.info(f"🚀 Starting async processing pipeline for document {document_id}")
@@ -78,16 +122,16 @@ class ProcessingPipeline:
             structured_ocr_data = await self._execute_ocr_stage(document_id, file_url)
             
             # Stage 2: AI Analysis (Data Extraction + Insights)
-            insights_result = await self._execute_analysis_stage(document_id, structured_ocr_data)
+            insights_result = await self._execute_analysis_stage(document_id, structured_ocr_data, refresh)
             
             # Stage 3: Save Results
-            await self._execute_save_stage(document_id, filename, structured_ocr_data, insights_result)
+            await self._execute_save_stage(document_id, insights_result)
             
             logger.info(f"✅ Successfully completed processing pipeline for document {document_id}")
             
         except Exception as e:
             logger.error(f"❌ Processing pipeline failed for document {document_id}: {e}", exc_info=True)
-            self.db_manager.mark_document_error(document_id, str(e))
+            await self.db_manager.mark_document_error(document_id, str(e))
             raise
     
     async def _execute_ocr_stage(self, document_id: str, file_url: str) -> Dict:
@@ -105,108 +149,145 @@ class ProcessingPipeline:
             ValueError: If OCR extraction yields no data
         """
         logger.info(f"📄 Stage 1/4: Starting OCR extraction for {document_id}")
-        self.db_manager.update_processing_stage(document_id, ProcessingStage.OCR_EXTRACTION)
-        
-        structured_ocr_data = self.ocr_agent.extract_structured_data(file_url)
+        # The stage write (no row returned) is awaited before OCR starts: a worker thread
+        # cannot be cancelled, so overlapping them would leave OCR running after a failed write
+        await self.db_manager.update_processing_stage(document_id, ProcessingStage.OCR_EXTRACTION)
+        # The OCR client is synchronous (requests); run it in a worker thread so the
+        # event loop keeps serving other documents and requests meanwhile.
+        structured_ocr_data = await self._ocr_breaker.call(lambda: retry_on_rate_limit(
+            "MistralOCR", lambda: asyncio.to_thread(self.ocr_agent.extract_structured_data, file_url)
+        ))
         if not structured_ocr_data or not structured_ocr_data.get('pages'):
             raise ValueError("OCR process yielded no pages or data")
-        
-        # Log raw text for debugging purposes
-        raw_text_for_db = "".join([page.get('markdown', '') for page in structured_ocr_data.get('pages', [])])
-        self.db_manager.update_document_raw_text(document_id, raw_text_for_db)
 
         logger.info(f"✅ OCR extraction completed for {document_id}")
         return structured_ocr_data
     
-    async def _execute_analysis_stage(self, document_id: str, structured_ocr_data: Dict) -> HealthInsights:
+    async def _execute_analysis_stage(
+        self, document_id: str, structured_ocr_data: Dict, refresh: bool = False
+    ) -> HealthInsights:
         """
         Execute AI analysis stage with progress tracking.
         
         Args:
             document_id: ID of the document being processed
             structured_ocr_data: The structured JSON response from the OCR service.
+            refresh: Bypass (and replace) the cached agent responses
             
         Returns:
             HealthInsights: Structured health insights from AI analysis
         """
         # Stage 2a: Data Extraction
         logger.info(f"🧠 Stage 2a/4: Starting Data Extraction for {document_id}")
-        self.db_manager.update_processing_stage(
-            document_id, 
-            ProcessingStage.AI_ANALYSIS, 
-            {"progress": 30}
-        )
         
-        extracted_data = await self.extraction_agent.extract_data(structured_ocr_data)
+        # The OCR text is stored (for display and debugging) with the same write as the stage change.
+        # The extraction call does not depend on that write, so both run side by side.
+        raw_text = "".join([page.get('markdown', '') for page in structured_ocr_data.get('pages', [])])
+        extracted_data = await self._with_stage_write(
+            self.db_manager.update_processing_stage(
+                document_id, 
+                ProcessingStage.AI_ANALYSIS, 
+                {"progress": 30, "raw_text": raw_text}
+            ),
+            self.extraction_agent.extract_data(structured_ocr_data, refresh)
+        )
         if not extracted_data.markers:
             logger.warning(f"ExtractionAgent returned no markers for document {document_id}")
         
         # Stage 2b: Insight Generation
         logger.info(f"🧠 Stage 2b/4: Starting Insight Generation for {document_id}")
-        self.db_manager.update_processing_stage(document_id, ProcessingStage.AI_ANALYSIS, {"progress": 50})
-        
-        insights_result = await self.insight_agent.generate_insights(extracted_data)
+        insights_result = await self._with_stage_write(
+            self.db_manager.update_processing_stage(document_id, ProcessingStage.AI_ANALYSIS, {"progress": 50}),
+            self.insight_agent.generate_insights(extracted_data, refresh)
+        )
         
         logger.info(f"✅ AI analysis completed for {document_id}")
         return insights_result
     
-    async def _execute_save_stage(self, document_id: str, filename: str, structured_ocr_data: Dict, insights_result: HealthInsights) -> None:
+    @staticmethod
+    async def _with_stage_write(write: Awaitable[None], call: Awaitable[T]) -> T:
+        """
+        Run an agent call while a stage write is in flight.
+        
+        If the write fails, the call is cancelled (releasing its provider slot) before
+        the error propagates. If the call fails first, the write is still awaited, so it
+        cannot land after the document has been marked as failed.
+        
+        Args:
+            write: Stage/progress update for the document
+            call: Agent request that does not depend on the write
+            
+        Returns:
+            The result of the call
+        """
+        task = asyncio.ensure_future(call)
+        try:
+            await write
+        except BaseException:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+        return await task
+    
+    async def _execute_save_stage(self, document_id: str, insights_result: HealthInsights) -> None:
         """
         Execute save results stage with progress tracking.
         
         Args:
             document_id: ID of the document being processed
-            filename: Original filename of the document
-            structured_ocr_data: The structured JSON response from the OCR service.
             insights_result: Health insights from AI analysis
         """
         logger.info(f"💾 Stage 3/4: Saving analysis results for {document_id}")
-        self.db_manager.update_processing_stage(document_id, ProcessingStage.SAVING_RESULTS)
-        
-        # Add brief delay for stage visibility
-        await asyncio.sleep(0.5)
-
-        # For debugging, we still save the raw text, but the insights are generated from structured data
-        raw_text = "".join([page.get('markdown', '') for page in structured_ocr_data.get('pages', [])])
-        
-        # Save complete results
-        final_data = {
-            "id": document_id,
-            "filename": filename,
-            "status": "complete",
-            "raw_text": raw_text,
-            "analysis": insights_result.model_dump(mode='json'),
-            "progress": STAGE_PROGRESS[ProcessingStage.COMPLETE],
-            "processing_stage": ProcessingStage.COMPLETE
-        }
+        # Brief delay for stage visibility; the stage write round-trips during it
+        await asyncio.gather(
+            self.db_manager.update_processing_stage(document_id, ProcessingStage.SAVING_RESULTS),
+            asyncio.sleep(0.5)
+        )
         
-        # Save to database
-        self._save_document_data(document_id, final_data)
+        try:
+            # Saves the analysis and marks the document complete in a single transaction.
+            # The markdown is rendered here, where the validated model is at hand.
+            await self.db_manager.finalize_document(
+                document_id,
+                insights_result.model_dump(mode='json'),
+                format_insights_as_markdown(insights_result)
+            )
+        except Exception as e:
+            logger.error(f"Error saving document data for {document_id}: {e}", exc_info=True)
+            await self.db_manager.mark_document_error(document_id, str(e))
+            raise
         
         logger.info(f"✅ Results saved for {document_id}")
     
-    def _save_document_data(self, document_id: str, data: Dict) -> None:
+    async def resume_interrupted(self) -> int:
         """
-        Save document data with analysis results.
+        Re-queue documents left in processing by a previous run of the process.
         
-        Args:
-            document_id: ID of the document
-            data: Complete document data including analysis
+        Pipelines only live in this process, so a restart or crash leaves their
+        documents stuck in "processing". Called once at startup, before any upload
+        can be scheduled; each document restarts from OCR (responses already cached
+        by the agents are reused).
+        
+        Returns:
+            int: Number of documents re-queued
         """
         try:
-            # Update main document table
-            self.db_manager.update_document_table(document_id, data)
-            
-            # Save analysis results if available
-            if "analysis" in data and data["analysis"]:
-                self.db_manager.save_analysis_results(document_id, data["analysis"])
-                
-            logger.info(f"Document data saved successfully for {document_id}")
-            
+            documents = await self.db_manager.list_processing_documents()
         except Exception as e:
-            logger.error(f"Error saving document data for {document_id}: {e}", exc_info=True)
-            self.db_manager.mark_document_error(document_id, str(e))
-            raise
+            logger.error(f"Could not load interrupted documents: {e}", exc_info=True)
+            return 0
+        
+        resumed = 0
+        for document in documents:
+            if not document.get("public_url"):
+                logger.warning(f"Document {document['id']} has no file URL, cannot resume")
+                continue
+            if self.schedule(document["id"], document["public_url"], document.get("filename", "unknown")):
+                resumed += 1
+        
+        if resumed:
+            logger.info(f"🔄 Resumed {resumed} interrupted document(s)")
+        return resumed
     
     async def retry_processing(self, document_id: str) -> bool:
         """
@@ -222,7 +303,7 @@ class ProcessingPipeline:
             bool: True if retry was initiated, False if document not found or already complete
         """
         try:
-            document_data = self.db_manager.load_document_data(document_id)
+            document_data = await self.db_manager.load_document_data(document_id)
             if not document_data:
                 logger.warning(f"Document {document_id} not found for retry")
                 return False
@@ -232,6 +313,11 @@ class ProcessingPipeline:
                 logger.info(f"Document {document_id} is already complete, skipping retry")
                 return False
             
+            # Don't restart a document that is still queued or running in this process
+            if document_id in self._tasks:
+                logger.info(f"Document {document_id} is already queued or processing, skipping retry")
+                return False
+            
             logger.info(f"🔄 Retrying processing for document {document_id}")
             
             # Reset document status to processing with initial stage
@@ -242,15 +328,16 @@ class ProcessingPipeline:
                 "error_message": None
             }
             
-            self.db_manager.update_document_table(document_id, reset_data)
+            await self.db_manager.update_document_table(document_id, reset_data)
             
             # Restart the processing pipeline
             file_url = document_data.get("public_url")
             filename = document_data.get("filename", "unknown")
             
             if file_url:
-                # Start async processing
-                asyncio.create_task(self.process_document_async(document_id, file_url, filename))
+                # Start async processing; an explicit retry should not replay the cached answers
+                if not self.schedule(document_id, file_url, filename, refresh=True):
+                    return False
                 logger.info(f"✅ Retry processing initiated for document {document_id}")
                 return True
             else:
@@ -0,0 +1,27 @@
+"""
+Report Formatter
+
+Renders structured health insights into the markdown report shown by the frontend.
+"""
+
+from models.health_models import HealthInsights
+
+
+def format_insights_as_markdown(insights: HealthInsights) -> str:
+    """
+    Convert structured insights to markdown format for frontend display.
+    
+    Args:
+        insights: Structured health insights
+        
+    Returns:
+        str: Formatted markdown string
+    """
+    key_findings = "".join(f"- {finding}\n" for finding in insights.key_findings)
+    recommendations = "".join(f"- {rec}\n" for rec in insights.recommendations)
+    return (
+        f"# Analysis Report\n\n## Summary\n{insights.summary}\n\n"
+        f"## Key Findings\n{key_findings}\n"
+        f"## Recommendations\n{recommendations}\n"
+        f"---\n\n**Disclaimer:** {insights.disclaimer}"
+    )
@@ -5,15 +5,45 @@ Handles all file storage operations for documents including upload, deletion, an
 Provides clean separation of storage concerns from business logic.
 """
 
+import io
 import logging
 import asyncio
-from typing import Optional
+from typing import BinaryIO, List, Optional, Tuple, Union
 from supabase import Client
 
 from config.settings import settings
+from services.concurrency import retry_with_backoff
 
 logger = logging.getLogger(__name__)
 
+# Leading bytes of the formats we accept, mapped to their MIME type
+CONTENT_TYPE_SIGNATURES = (
+    (b"%PDF", "application/pdf"),
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+# Storage paths embed the document UUID, so an object never changes once written.
+# storage3 sends this as "max-age=<value>".
+UPLOAD_CACHE_MAX_AGE_SECONDS = "31536000"
+
+
+def _sniff_content_type(head: bytes) -> str:
+    """
+    Infer the MIME type from the first bytes of a file.
+    
+    Args:
+        head: Leading bytes of the file (a few are enough)
+        
+    Returns:
+        str: Matching MIME type, or application/octet-stream if unknown
+    """
+    for signature, content_type in CONTENT_TYPE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return DEFAULT_CONTENT_TYPE
+
 
 class StorageManager:
     """
@@ -33,12 +63,17 @@ class StorageManager:
         self.supabase = supabase_client
         self.bucket_name = settings.SUPABASE_BUCKET_NAME
     
-    def upload_file(self, file_content: bytes, storage_path: str) -> str:
+    async def upload_file(self, file: Union[bytes, BinaryIO], storage_path: str) -> str:
         """
         Upload file to Supabase storage and return public URL.
         
+        File objects (e.g. an UploadFile's spooled temp file) are streamed to storage
+        in chunks by httpx instead of being read into memory first. The blocking
+        storage request runs in a worker thread; building the public URL is local
+        string formatting.
+        
         Args:
-            file_content: Binary content of the file
+            file: Binary content of the file, or a readable binary file object
             storage_path: Path where the file will be stored
             
         Returns:
@@ -47,11 +82,17 @@ class StorageManager:
         Raises:
             Exception: If upload fails
         """
+        # storage3 only streams bytes, BufferedReader and FileIO bodies
+        body = file if isinstance(file, (bytes, io.BufferedReader)) else io.BufferedReader(file)
+        # peek() fills the buffer without moving the stream position
+        content_type = _sniff_content_type(body[:8] if isinstance(body, bytes) else body.peek(8))
+        
         try:
-            self.supabase.storage.from_(self.bucket_name).upload(
+            await asyncio.to_thread(
+                self.supabase.storage.from_(self.bucket_name).upload,
                 path=storage_path,
-                file=file_content,
-                file_options={"cache-control": "3600", "content-type": "application/pdf"}
+                file=body,
+                file_options={"cache-control": UPLOAD_CACHE_MAX_AGE_SECONDS, "content-type": content_type}
             )
             public_url = self.supabase.storage.from_(self.bucket_name).get_public_url(storage_path)
             logger.info(f"Successfully uploaded file to storage: {storage_path}")
@@ -60,6 +101,48 @@ class StorageManager:
             logger.error(f"Failed to upload file to storage: {storage_path}, error: {e}")
             raise
     
+    async def upload_files(self, files: List[Tuple[Union[bytes, BinaryIO], str]]) -> List[str]:
+        """
+        Upload several files concurrently and return their public URLs.
+        
+        Storage has no multi-object upload, so each file is still one request, but
+        the requests run side by side instead of one after another.
+        If any upload fails, the files that did upload are removed before re-raising.
+        
+        Args:
+            files: (file, storage_path) pairs; file is bytes or a binary file object
+            
+        Returns:
+            List[str]: Public URLs, in the same order as `files`
+            
+        Raises:
+            Exception: The first upload error
+        """
+        results = await asyncio.gather(
+            *(self.upload_file(file, path) for file, path in files),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            uploaded = [path for (_, path), result in zip(files, results) if not isinstance(result, Exception)]
+            if uploaded:
+                await self.delete_files(uploaded)
+            raise errors[0]
+        return results
+    
+    async def delete_files(self, storage_paths: List[str]) -> None:
+        """
+        Delete several files from storage in a single request (best effort).
+        
+        Args:
+            storage_paths: Paths of the files in storage
+        """
+        try:
+            await asyncio.to_thread(self.supabase.storage.from_(self.bucket_name).remove, storage_paths)
+            logger.info(f"Deleted {len(storage_paths)} files from storage")
+        except Exception as e:
+            logger.warning(f"Failed to delete storage files {storage_paths}: {e}")
+    
     async def delete_file(self, storage_path: Optional[str]) -> None:
         """
         Delete file from storage if path exists.
@@ -71,7 +154,7 @@ class StorageManager:
             return
             
         try:
-            self.supabase.storage.from_(self.bucket_name).remove([storage_path])
+            await asyncio.to_thread(self.supabase.storage.from_(self.bucket_name).remove, [storage_path])
             logger.info(f"Successfully deleted file from storage: {storage_path}")
         except Exception as e:
             logger.warning(f"Failed to delete storage file {storage_path}: {e}")
@@ -87,19 +170,13 @@ class StorageManager:
         Raises:
             Exception: If all retry attempts fail
         """
-        retry_delay = 1.0
-        
-        for attempt in range(max_retries):
-            try:
-                self.supabase.storage.from_(self.bucket_name).remove([storage_path])
-                logger.info(f"Successfully deleted file from storage: {storage_path}")
-                return
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Storage file deletion attempt {attempt + 1} failed for {storage_path}: {e}")
-                    logger.info(f"Retrying storage file deletion in {retry_delay} seconds...")
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    logger.error(f"All storage file deletion attempts failed for {storage_path}: {e}")
-                    raise
\ No newline at end of file
+        try:
+            await retry_with_backoff(
+                f"Storage file deletion for {storage_path}",
+                lambda: asyncio.to_thread(self.supabase.storage.from_(self.bucket_name).remove, [storage_path]),
+                max_attempts=max_retries
+            )
+        except Exception as e:
+            logger.error(f"All storage file deletion attempts failed for {storage_path}: {e}")
+            raise
+        logger.info(f"Successfully deleted file from storage: {storage_path}")
\ No newline at end of file
@@ -0,0 +1,181 @@
+import asyncio
+import time
+import httpx
+import pytest
+import requests
+from unittest.mock import AsyncMock
+
+from services.concurrency import (
+    CircuitBreaker, CircuitOpenError, RequestCoalescer, is_rate_limit_error, retry_on_rate_limit, retry_with_backoff
+)
+
+@pytest.mark.asyncio
+async def test_coalescer_shares_identical_inflight_calls():
+    """Concurrent callers with the same key should trigger a single call."""
+    coalescer = RequestCoalescer("test")
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    key = RequestCoalescer.make_key("model", "payload")
+    results = await asyncio.gather(*(coalescer.run(key, call) for _ in range(3)))
+
+    assert results == ["result", "result", "result"]
+    assert calls == 1
+
+@pytest.mark.asyncio
+async def test_coalescer_does_not_cache_finished_calls():
+    """Once a call has finished, the next caller should trigger a new one."""
+    coalescer = RequestCoalescer("test")
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    key = RequestCoalescer.make_key("payload")
+    assert await coalescer.run(key, call) == 1
+    assert await coalescer.run(key, call) == 2
+
+@pytest.mark.asyncio
+async def test_coalescer_propagates_errors_to_all_callers():
+    """A failing shared call should raise for every caller waiting on it."""
+    coalescer = RequestCoalescer("test")
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError("provider down")
+
+    key = RequestCoalescer.make_key("payload")
+    results = await asyncio.gather(
+        coalescer.run(key, call), coalescer.run(key, call), return_exceptions=True
+    )
+
+    assert all(isinstance(r, ValueError) for r in results)
+
+def test_make_key_separates_parts():
+    """Keys should differ when the same text is split differently."""
+    assert RequestCoalescer.make_key("ab", "c") != RequestCoalescer.make_key("a", "bc")
+
+def _rate_limited() -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://api.example/chat/completions")
+    return httpx.HTTPStatusError("429", request=request, response=httpx.Response(429, request=request))
+
+@pytest.mark.asyncio
+async def test_retry_on_rate_limit_retries_429(monkeypatch):
+    """A 429 should be retried after a backoff, and the later success returned."""
+    monkeypatch.setattr(asyncio, "sleep", AsyncMock())
+    call = AsyncMock(side_effect=[_rate_limited(), "result"])
+
+    assert await retry_on_rate_limit("test", call, max_attempts=3) == "result"
+    assert call.await_count == 2
+    asyncio.sleep.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_retry_on_rate_limit_gives_up_after_max_attempts(monkeypatch):
+    """Persistent rate limiting should surface the last error."""
+    monkeypatch.setattr(asyncio, "sleep", AsyncMock())
+    call = AsyncMock(side_effect=_rate_limited())
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await retry_on_rate_limit("test", call, max_attempts=3)
+    assert call.await_count == 3
+
+@pytest.mark.asyncio
+async def test_retry_on_rate_limit_does_not_retry_other_errors():
+    """Errors other than rate limits should be raised on the first attempt."""
+    call = AsyncMock(side_effect=ValueError("bad response"))
+
+    with pytest.raises(ValueError):
+        await retry_on_rate_limit("test", call, max_attempts=3)
+    assert call.await_count == 1
+
+def _requests_http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} Error", response=response)
+
+def test_is_rate_limit_error_matches_wrapped_messages():
+    """Errors that lost their status code are matched on the message."""
+    assert is_rate_limit_error(Exception("429 Client Error: Too Many Requests for url"))
+    assert not is_rate_limit_error(Exception("500 Server Error"))
+
+def test_is_rate_limit_error_reads_requests_status():
+    """The OCR service re-raises requests errors, whose status code is checked directly."""
+    assert is_rate_limit_error(_requests_http_error(429))
+    assert not is_rate_limit_error(_requests_http_error(404))
+
+@pytest.mark.asyncio
+async def test_retry_with_backoff_waits_are_jittered_and_bounded(monkeypatch):
+    """Waits should stay between the base delay and the cap, whatever the error."""
+    monkeypatch.setattr(asyncio, "sleep", AsyncMock())
+    call = AsyncMock(side_effect=[OSError("reset"), OSError("reset"), OSError("reset"), "done"])
+
+    assert await retry_with_backoff("test", call, max_attempts=4, base_delay=1.0, max_delay=3.0) == "done"
+
+    delays = [c.args[0] for c in asyncio.sleep.await_args_list]
+    assert len(delays) == 3
+    assert all(1.0 <= d <= 3.0 for d in delays)
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_opens_and_recovers(monkeypatch):
+    """Consecutive provider failures open the circuit; after the reset timeout a success closes it."""
+    now = 100.0
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    breaker = CircuitBreaker("test", fail_max=2, reset_timeout=30)
+    failing = AsyncMock(side_effect=httpx.ConnectError("down"))
+
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await breaker.call(failing)
+
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(failing)
+    assert failing.await_count == 2
+
+    now += 31
+    assert await breaker.call(AsyncMock(return_value="ok")) == "ok"
+    assert not breaker.is_open
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_ignores_client_errors():
+    """A 4xx other than 429 is the request's fault and should not open the circuit."""
+    breaker = CircuitBreaker("test", fail_max=1, reset_timeout=30)
+    request = httpx.Request("POST", "https://api.example/chat/completions")
+    bad_request = httpx.HTTPStatusError("400", request=request, response=httpx.Response(400, request=request))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await breaker.call(AsyncMock(side_effect=bad_request))
+    assert not breaker.is_open
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [
+    Exception("An unexpected error occurred while processing a.txt: Unsupported MIME type: text/plain"),
+    _requests_http_error(404),
+    _requests_http_error(422),
+])
+async def test_circuit_breaker_ignores_user_caused_ocr_errors(error):
+    """Bad uploads (unsupported files, missing objects, rejected payloads) must not open the shared circuit."""
+    breaker = CircuitBreaker("MistralOCR", fail_max=1, reset_timeout=30)
+
+    with pytest.raises(type(error)):
+        await breaker.call(AsyncMock(side_effect=error))
+    assert not breaker.is_open
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [
+    _requests_http_error(503), requests.ConnectionError("reset"), requests.Timeout("read timed out")
+])
+async def test_circuit_breaker_counts_ocr_outages(error):
+    """5xx responses, connection errors and timeouts from the OCR provider count as failures."""
+    breaker = CircuitBreaker("MistralOCR", fail_max=1, reset_timeout=30)
+
+    with pytest.raises(type(error)):
+        await breaker.call(AsyncMock(side_effect=error))
+    assert breaker.is_open
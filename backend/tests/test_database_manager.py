@@ -0,0 +1,225 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+from postgrest.types import ReturnMethod
+from supabase import Client
+
+from services.database_manager import (
+    COMPLETE_CACHE_TTL_SECONDS, READ_CACHE_TTL_SECONDS, DatabaseManager, _read_cache_ttu
+)
+
+@pytest.fixture
+def mock_supabase_client():
+    """Mock Supabase client exposing table and rpc builders."""
+    mock_client = MagicMock(spec=Client)
+    mock_client.rpc.return_value.execute.return_value = MagicMock(data="analysis_id")
+    return mock_client
+
+@pytest.fixture
+def database_manager(mock_supabase_client):
+    """DatabaseManager wired to the mocked client."""
+    return DatabaseManager(mock_supabase_client)
+
+@pytest.fixture
+def analysis_data():
+    """Analysis payload as produced by HealthInsights.model_dump(mode='json')."""
+    return {
+        "data": {
+            "markers": [
+                {"marker": "Hemoglobin", "value": "14.5", "unit": "g/dL",
+                 "reference_range": "13.5 - 17.5", "is_out_of_range": False}
+            ],
+            "document_type": "Blood Test Report",
+            "test_date": None
+        },
+        "summary": "All values are within range.",
+        "key_findings": ["Hemoglobin is normal."],
+        "recommendations": ["Keep up the healthy lifestyle."],
+        "disclaimer": "Not medical advice."
+    }
+
+@pytest.mark.asyncio
+async def test_finalize_document_uses_single_rpc(database_manager, mock_supabase_client, analysis_data):
+    """Saving an analysis and completing the document should be one RPC call, with no direct table access."""
+    await database_manager.finalize_document("test_doc", analysis_data, "# Analysis Report")
+
+    mock_supabase_client.rpc.assert_called_once()
+    fn_name, params = mock_supabase_client.rpc.call_args.args
+    assert fn_name == "finalize_document"
+    assert params["p_document_id"] == "test_doc"
+    assert params["p_structured_data"] == analysis_data
+    assert params["p_insights"] == "# Analysis Report"
+    mock_supabase_client.table.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_list_documents_reads_summary_view(database_manager, mock_supabase_client):
+    """The list should come from the summary view, without analysis payloads."""
+    query = mock_supabase_client.table.return_value.select.return_value.order.return_value
+    query.execute.return_value = MagicMock(data=[
+        {"id": "doc1", "document_id": "doc1", "filename": "a.pdf",
+         "uploaded_at": "2025-01-03T10:00:00+00:00", "status": "complete", "marker_count": 12}
+    ])
+
+    result = await database_manager.list_documents()
+
+    mock_supabase_client.table.assert_called_once_with("documents_list_view")
+    columns = mock_supabase_client.table.return_value.select.call_args.args[0]
+    assert "structured_data" not in columns and "insights" not in columns
+    assert result[0]["uploaded_at"] == "2025-01-03T10:00:00+00:00"
+    assert result[0]["marker_count"] == 12
+    assert "ai_insights" not in result[0]
+
+@pytest.mark.asyncio
+async def test_get_analysis_is_cached_until_document_changes(database_manager, mock_supabase_client):
+    """Repeated reads hit the cache; a write to the document invalidates it."""
+    select = mock_supabase_client.table.return_value.select.return_value
+    select.eq.return_value.maybe_single.return_value.execute.return_value = MagicMock(
+        data={"id": "test_doc", "status": "processing", "analysis_results": []}
+    )
+
+    first = await database_manager.get_analysis("test_doc")
+    second = await database_manager.get_analysis("test_doc")
+    assert first == second
+    assert select.eq.call_count == 1
+
+    await database_manager.mark_document_error("test_doc", "boom")
+    await database_manager.get_analysis("test_doc")
+    assert select.eq.call_count == 2
+
+@pytest.mark.asyncio
+async def test_writes_do_not_request_row_representation(database_manager, mock_supabase_client):
+    """Progress and raw_text writes should not have PostgREST echo the row back."""
+    await database_manager.update_processing_stage("test_doc", "ai_analysis", {"progress": 30, "raw_text": "a long OCR transcript"})
+    await database_manager.mark_document_error("test_doc", "boom")
+
+    for call in mock_supabase_client.table.return_value.update.call_args_list:
+        assert call.kwargs["returning"] == ReturnMethod.minimal
+
+@pytest.mark.asyncio
+async def test_load_document_data_skips_raw_text(database_manager, mock_supabase_client):
+    """Lifecycle reads should not pull the (potentially large) OCR text."""
+    select = mock_supabase_client.table.return_value.select
+    select.return_value.eq.return_value.maybe_single.return_value.execute.return_value = MagicMock(
+        data={"id": "test_doc", "storage_path": "test_doc.pdf"}
+    )
+
+    result = await database_manager.load_document_data("test_doc")
+
+    assert result["storage_path"] == "test_doc.pdf"
+    columns = select.call_args.args[0]
+    assert "raw_text" not in columns and "*" not in columns
+
+@pytest.mark.asyncio
+async def test_get_analysis_flattens_embedded_analysis(database_manager, mock_supabase_client):
+    """Markers and insights from the one-to-one embed become top-level fields."""
+    select = mock_supabase_client.table.return_value.select
+    select.return_value.eq.return_value.maybe_single.return_value.execute.return_value = MagicMock(data={
+        "id": "test_doc", "document_id": "test_doc", "status": "complete",
+        "analysis_results": {"extracted_data": [{"marker": "Hemoglobin"}], "ai_insights": "# Analysis Report"}
+    })
+
+    result = await database_manager.get_analysis("test_doc")
+
+    assert "extracted_data:structured_data->data->markers" in select.call_args.args[0]
+    assert result["extracted_data"] == [{"marker": "Hemoglobin"}]
+    assert result["ai_insights"] == "# Analysis Report"
+    assert "analysis_results" not in result
+
+@pytest.mark.asyncio
+async def test_timestamps_are_utc_or_server_side(database_manager, mock_supabase_client):
+    """upload_date comes from the column default; processed_at is sent in UTC."""
+    table = mock_supabase_client.table.return_value
+
+    await database_manager.create_document_record("test_doc", "a.pdf", "test_doc.pdf", "http://fake.url/a.pdf")
+    assert "upload_date" not in table.insert.call_args.args[0]
+
+    await database_manager.update_document_table("test_doc", {"status": "complete"})
+    assert table.update.call_args.args[0]["processed_at"].endswith("+00:00")
+
+def test_completed_documents_stay_cached_longer():
+    """Completed documents are immutable and get the long TTL; in-flight ones the short one."""
+    assert _read_cache_ttu(None, {"status": "complete"}, 100.0) == 100.0 + COMPLETE_CACHE_TTL_SECONDS
+    assert _read_cache_ttu(None, {"status": "processing"}, 100.0) == 100.0 + READ_CACHE_TTL_SECONDS
+
+@pytest.mark.asyncio
+async def test_list_documents_pages_server_side(database_manager, mock_supabase_client):
+    """limit/offset should become a PostgREST range instead of slicing in Python."""
+    ordered = mock_supabase_client.table.return_value.select.return_value.order.return_value
+    ordered.range.return_value.execute.return_value = MagicMock(data=[])
+
+    await database_manager.list_documents(limit=20, offset=40)
+
+    ordered.range.assert_called_once_with(40, 59)
+
+@pytest.mark.asyncio
+async def test_repeated_stage_update_is_skipped(database_manager, mock_supabase_client):
+    """The same (stage, progress) is written once until another write touches the document."""
+    update = mock_supabase_client.table.return_value.update
+
+    await database_manager.update_processing_stage("test_doc", "ai_analysis", {"progress": 50})
+    await database_manager.update_processing_stage("test_doc", "ai_analysis", {"progress": 50})
+    assert update.call_count == 1
+
+    await database_manager.mark_document_error("test_doc", "boom")
+    await database_manager.update_processing_stage("test_doc", "ai_analysis", {"progress": 50})
+    assert update.call_count == 3
+
+@pytest.mark.asyncio
+async def test_list_documents_cached_until_a_write(database_manager, mock_supabase_client):
+    """Repeated list reads share one query; creating a document drops the cached pages."""
+    ordered = mock_supabase_client.table.return_value.select.return_value.order.return_value
+    ordered.execute.return_value = MagicMock(data=[])
+
+    await database_manager.list_documents()
+    await database_manager.list_documents()
+    assert ordered.execute.call_count == 1
+
+    await database_manager.create_document_record("test_doc", "a.pdf", "test_doc.pdf", "http://fake.url/a.pdf")
+    await database_manager.list_documents()
+    assert ordered.execute.call_count == 2
+
+@pytest.mark.asyncio
+async def test_wait_for_change_wakes_on_document_write(database_manager):
+    """Stream waiters are woken by a write to their document and time out otherwise."""
+    waiter = asyncio.create_task(database_manager.wait_for_change("test_doc", timeout=5))
+    await asyncio.sleep(0)
+
+    await database_manager.update_processing_stage("test_doc", "ai_analysis", {"progress": 50})
+
+    assert await waiter is True
+    assert await database_manager.wait_for_change("test_doc", timeout=0.01) is False
+
+@pytest.mark.asyncio
+async def test_read_overlapping_a_write_is_not_cached(database_manager):
+    """A read that started before a write must not cache the row it loaded before that write."""
+    loaded = asyncio.Event()
+    release = asyncio.Event()
+    rows = iter([{"id": "test_doc", "status": "processing", "progress": 10},
+                 {"id": "test_doc", "status": "processing", "progress": 50}])
+
+    async def fetch_analysis(document_id):
+        row = next(rows)
+        loaded.set()
+        await release.wait()
+        return row
+
+    database_manager._fetch_analysis = fetch_analysis
+    reader = asyncio.create_task(database_manager.get_analysis("test_doc"))
+    await loaded.wait()
+
+    await database_manager.update_processing_stage("test_doc", "ai_analysis", {"progress": 50})
+    release.set()
+    assert (await reader)["progress"] == 10
+
+    assert (await database_manager.get_analysis("test_doc"))["progress"] == 50
+    assert database_manager._generations == {} and database_manager._readers == {}
+
+@pytest.mark.asyncio
+async def test_wait_for_change_releases_event_after_last_waiter(database_manager):
+    """Streams on documents this process never writes must not leave events behind."""
+    waiters = [asyncio.create_task(database_manager.wait_for_change("unknown_doc", timeout=0.01)) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert database_manager._waiters == {"unknown_doc": 2}
+
+    assert await asyncio.gather(*waiters) == [False, False]
+    assert database_manager._change_events == {} and database_manager._waiters == {}
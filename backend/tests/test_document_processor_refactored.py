@@ -1,15 +1,25 @@
+import asyncio
+import io
+import tempfile
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 from datetime import datetime
 import logging
 from supabase import Client
 
-from services.document_processor import DocumentProcessor
+from services.document_processor import DocumentProcessor, _get_supabase
 from services.storage_manager import StorageManager
 from services.database_manager import DatabaseManager
 from services.processing_pipeline import ProcessingPipeline
 from models.health_models import HealthInsights, HealthMarker, HealthDataExtraction
 
+@pytest.fixture(autouse=True)
+def clear_supabase_client_cache():
+    """Drop the memoized client so each test sees its own patched create_client."""
+    _get_supabase.cache_clear()
+    yield
+    _get_supabase.cache_clear()
+
 @pytest.fixture
 def mock_supabase_client():
     """Mock Supabase client with all necessary operations."""
@@ -47,6 +57,7 @@ def mock_processing_pipeline():
     """Mock processing pipeline with async methods."""
     mock_pipeline = MagicMock(spec=ProcessingPipeline)
     mock_pipeline.process_document_async = AsyncMock()
+    mock_pipeline.schedule = MagicMock(return_value=True)
     mock_pipeline.retry_processing = AsyncMock(return_value=True)
     return mock_pipeline
 
@@ -75,8 +86,35 @@ async def test_process_document_success(document_processor, mock_processing_pipe
     assert document_id is not None
     assert len(document_id) == 36  # UUID length
     
-    # Verify pipeline was called
-    mock_processing_pipeline.process_document_async.assert_called_once()
+    # Verify the document was queued on the pipeline
+    mock_processing_pipeline.schedule.assert_called_once_with(document_id, "http://fake.url/test.pdf", filename)
+
+@pytest.mark.asyncio
+async def test_process_documents_batch(document_processor, mock_supabase_client, mock_processing_pipeline):
+    """A batch upload inserts all records at once and queues one pipeline per document."""
+    files = [(b"first", "a.pdf"), (b"second", "b.png")]
+    
+    document_ids = await document_processor.process_documents(files)
+    
+    assert len(document_ids) == 2
+    rows = mock_supabase_client.table.return_value.insert.call_args.args[0]
+    mock_supabase_client.table.return_value.insert.assert_called_once()
+    assert [row["id"] for row in rows] == document_ids
+    assert rows[1]["storage_path"] == f"{document_ids[1]}.png"
+    assert mock_processing_pipeline.schedule.call_count == 2
+
+@pytest.mark.asyncio
+async def test_process_documents_upload_failure_cleans_up(document_processor, mock_supabase_client, mock_processing_pipeline):
+    """If one upload fails, uploaded files are removed and no record is created."""
+    storage = mock_supabase_client.storage.from_.return_value
+    storage.upload.side_effect = [None, Exception("Storage unavailable")]
+    
+    with pytest.raises(Exception, match="Storage unavailable"):
+        await document_processor.process_documents([(b"first", "a.pdf"), (b"second", "b.pdf")])
+    
+    storage.remove.assert_called_once()
+    mock_supabase_client.table.return_value.insert.assert_not_called()
+    mock_processing_pipeline.schedule.assert_not_called()
 
 @pytest.mark.asyncio
 async def test_delete_document_success():
@@ -92,20 +130,46 @@ async def test_delete_document_success():
         processor = DocumentProcessor()
         
         # Mock the database manager methods directly
-        processor.database_manager.load_document_data = MagicMock(return_value=mock_document_data)
-        processor.database_manager.delete_analysis_data = AsyncMock()
-        processor.database_manager.delete_document_record = MagicMock()
+        processor.database_manager.load_document_data = AsyncMock(return_value=mock_document_data)
+        processor.database_manager.delete_document_record = AsyncMock()
         processor.storage_manager.delete_file_with_retry = AsyncMock()
         
         # Execute
         result = await processor.delete_document("test_doc")
         
-        # Assertions
+        # Assertions (analysis data is removed by ON DELETE CASCADE with the record)
         assert result is True
-        processor.database_manager.delete_analysis_data.assert_called_once_with("test_doc")
         processor.storage_manager.delete_file_with_retry.assert_called_once_with("test.pdf")
         processor.database_manager.delete_document_record.assert_called_once_with("test_doc")
 
+@pytest.mark.asyncio
+async def test_delete_document_storage_runs_concurrently_and_tolerates_failures():
+    """Storage and record deletion run side by side; a storage failure does not fail the delete."""
+    with patch('services.document_processor.create_client') as mock_create_client:
+        mock_create_client.return_value = MagicMock(spec=Client)
+        
+        processor = DocumentProcessor()
+        started = []
+        
+        async def delete_document_record(document_id):
+            started.append("record")
+            await asyncio.sleep(0.01)
+            # Storage deletion must already have started while this step is in flight
+            assert "storage" in started
+        
+        async def delete_file_with_retry(storage_path):
+            started.append("storage")
+            raise Exception("Storage unavailable")
+        
+        processor.database_manager.load_document_data = AsyncMock(return_value={"id": "test_doc", "storage_path": "test.pdf"})
+        processor.database_manager.delete_document_record = delete_document_record
+        processor.storage_manager.delete_file_with_retry = delete_file_with_retry
+        
+        result = await processor.delete_document("test_doc")
+        
+        assert result is True
+        assert started == ["record", "storage"]
+
 @pytest.mark.asyncio
 async def test_delete_document_not_found():
     """Test deletion of non-existent document."""
@@ -114,7 +178,7 @@ async def test_delete_document_not_found():
         mock_create_client.return_value = mock_supabase_client
         
         processor = DocumentProcessor()
-        processor.database_manager.load_document_data = MagicMock(return_value=None)
+        processor.database_manager.load_document_data = AsyncMock(return_value=None)
         
         # Execute
         result = await processor.delete_document("non_existent")
@@ -148,18 +212,19 @@ async def test_list_documents(document_processor):
     assert len(result) == 2
     assert result[0]["document_id"] == "doc1"
 
-def test_get_analysis(document_processor):
+@pytest.mark.asyncio
+async def test_get_analysis(document_processor):
     """Test getting document analysis."""
     # Mock the database manager
     mock_analysis = {"document_id": "test_doc", "status": "complete"}
-    document_processor.database_manager.get_analysis = MagicMock(return_value=mock_analysis)
+    document_processor.database_manager.get_analysis = AsyncMock(return_value=mock_analysis)
     
     # Execute
-    result = document_processor.get_analysis("test_doc")
+    result = await document_processor.get_analysis("test_doc")
     
     # Assertions
     assert result == mock_analysis
-    document_processor.database_manager.get_analysis.assert_called_once_with("test_doc")
+    document_processor.database_manager.get_analysis.assert_awaited_once_with("test_doc")
 
 @pytest.mark.asyncio
 async def test_delete_with_retry_logic():
@@ -172,12 +237,11 @@ async def test_delete_with_retry_logic():
         mock_document_data = {"id": "test_doc", "storage_path": "test.pdf"}
         
         # Mock methods to fail first, then succeed
-        processor.database_manager.load_document_data = MagicMock(return_value=mock_document_data)
-        processor.database_manager.delete_analysis_data = AsyncMock()
+        processor.database_manager.load_document_data = AsyncMock(return_value=mock_document_data)
         processor.storage_manager.delete_file_with_retry = AsyncMock()
         
         # Make document record deletion fail twice, then succeed
-        processor.database_manager.delete_document_record = MagicMock(
+        processor.database_manager.delete_document_record = AsyncMock(
             side_effect=[Exception("DB Error"), Exception("DB Error"), None]
         )
         
@@ -185,9 +249,10 @@ async def test_delete_with_retry_logic():
         with patch('asyncio.sleep'):
             result = await processor.delete_document("test_doc")
         
-        # Should succeed on third attempt
+        # Should succeed on third attempt, loading the document only once
         assert result is True
         assert processor.database_manager.delete_document_record.call_count == 3
+        processor.database_manager.load_document_data.assert_called_once_with("test_doc")
 
 @pytest.mark.asyncio  
 async def test_delete_max_retries_exceeded():
@@ -200,12 +265,11 @@ async def test_delete_max_retries_exceeded():
         mock_document_data = {"id": "test_doc", "storage_path": "test.pdf"}
         
         # Mock methods
-        processor.database_manager.load_document_data = MagicMock(return_value=mock_document_data)
-        processor.database_manager.delete_analysis_data = AsyncMock()
+        processor.database_manager.load_document_data = AsyncMock(return_value=mock_document_data)
         processor.storage_manager.delete_file_with_retry = AsyncMock()
         
         # Make document record deletion always fail
-        processor.database_manager.delete_document_record = MagicMock(
+        processor.database_manager.delete_document_record = AsyncMock(
             side_effect=Exception("Permanent DB Error")
         )
         
@@ -229,4 +293,66 @@ def test_smoke_test():
         assert processor is not None
         assert hasattr(processor, 'storage_manager')
         assert hasattr(processor, 'database_manager')
-        assert hasattr(processor, 'processing_pipeline')
\ No newline at end of file
+        assert hasattr(processor, 'processing_pipeline')
+
+def test_supabase_client_is_shared():
+    """Processors should reuse one Supabase client instead of creating their own."""
+    with patch('services.document_processor.create_client') as mock_create_client:
+        mock_create_client.return_value = MagicMock()
+        
+        first = DocumentProcessor()
+        second = DocumentProcessor()
+        
+        assert first.supabase is second.supabase
+        mock_create_client.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_close_releases_shared_client():
+    """Closing releases the shared client's sessions so the next processor gets a fresh one."""
+    with patch('services.document_processor.create_client') as mock_create_client:
+        mock_create_client.return_value = MagicMock()
+        
+        processor = DocumentProcessor()
+        processor.processing_pipeline = MagicMock(spec=ProcessingPipeline)
+        await processor.close()
+        
+        processor.processing_pipeline.close.assert_awaited_once()
+        processor.supabase.postgrest.aclose.assert_called_once()
+        processor.supabase.storage.aclose.assert_called_once()
+        assert _get_supabase.cache_info().currsize == 0
+
+@pytest.mark.asyncio
+async def test_process_document_streams_file_objects(document_processor, mock_supabase_client):
+    """File objects should reach storage as a stream rather than as bytes read up front."""
+    spooled = tempfile.SpooledTemporaryFile()
+    spooled.write(b"%PDF-1.4 test")
+    spooled.seek(0)
+    
+    await document_processor.process_document(spooled, "test.pdf")
+    
+    body = mock_supabase_client.storage.from_.return_value.upload.call_args.kwargs["file"]
+    assert isinstance(body, io.BufferedReader)
+    assert body.read() == b"%PDF-1.4 test"
+
+@pytest.mark.asyncio
+async def test_upload_sniffs_content_type(document_processor, mock_supabase_client):
+    """The stored MIME type should follow the file's magic bytes, not its extension."""
+    upload = mock_supabase_client.storage.from_.return_value.upload
+    
+    await document_processor.process_document(b"\x89PNG\r\n\x1a\n scan", "scan.png")
+    assert upload.call_args.kwargs["file_options"]["content-type"] == "image/png"
+    
+    await document_processor.process_document(io.BytesIO(b"%PDF-1.4 test"), "test.pdf")
+    assert upload.call_args.kwargs["file_options"]["content-type"] == "application/pdf"
+    assert upload.call_args.kwargs["file"].read() == b"%PDF-1.4 test"
+
+@pytest.mark.asyncio
+async def test_process_document_replay_returns_existing_document(document_processor, mock_supabase_client, mock_processing_pipeline):
+    """An upload replayed with the same idempotency key is neither stored nor processed again."""
+    document_processor.database_manager.find_document_by_idempotency_key = AsyncMock(return_value="existing_doc")
+    
+    document_id = await document_processor.process_document(b"%PDF-1.4 test", "test.pdf", idempotency_key="upload-1")
+    
+    assert document_id == "existing_doc"
+    mock_supabase_client.storage.from_.return_value.upload.assert_not_called()
+    mock_processing_pipeline.schedule.assert_not_called()
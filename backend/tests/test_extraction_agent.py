@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from models.health_models import HealthDataExtraction
+from services.extraction_agent import ExtractionAgent
+from services.llm_cache import LLMResponseCache
+
+OCR_DATA = {"pages": [{"index": 0, "markdown": "| Hemoglobin | 14.5 | 13.0-17.5 |"}]}
+
+@pytest.fixture
+def agent():
+    """Extraction agent with an empty response cache and a slow, counted model call."""
+    db_manager = MagicMock()
+    db_manager.get_llm_response = AsyncMock(return_value=None)
+    db_manager.save_llm_response = AsyncMock()
+    agent = ExtractionAgent(LLMResponseCache(db_manager, ttl_days=7))
+
+    async def request_extraction(ocr_json_string):
+        await asyncio.sleep(0.01)
+        return HealthDataExtraction(markers=[], document_type="Blood Test Report")
+
+    agent._request_extraction = AsyncMock(side_effect=request_extraction)
+    return agent
+
+@pytest.mark.asyncio
+async def test_identical_inflight_extractions_share_one_request(agent):
+    """Two uploads of the same document at once should reach the model once."""
+    await asyncio.gather(agent.extract_data(OCR_DATA), agent.extract_data(OCR_DATA))
+
+    assert agent._request_extraction.await_count == 1
+    await agent.close()
+
+@pytest.mark.asyncio
+async def test_refresh_does_not_join_inflight_extraction(agent):
+    """A retry asking for a fresh answer gets its own request, even while an identical one is in flight."""
+    await asyncio.gather(agent.extract_data(OCR_DATA), agent.extract_data(OCR_DATA, refresh=True))
+
+    assert agent._request_extraction.await_count == 2
+    agent._response_cache.db_manager.get_llm_response.assert_awaited_once()
+    await agent.close()
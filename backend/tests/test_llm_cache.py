@@ -0,0 +1,97 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from models.health_models import HealthDataExtraction
+from services.llm_cache import LLMResponseCache
+
+@pytest.fixture
+def db_manager():
+    """Database manager mock with an empty LLM cache table."""
+    db_manager = MagicMock()
+    db_manager.get_llm_response = AsyncMock(return_value=None)
+    db_manager.save_llm_response = AsyncMock()
+    return db_manager
+
+@pytest.mark.asyncio
+async def test_cache_miss_calls_model_and_stores_response(db_manager):
+    """On a miss the model is called and its validated response stored as JSON."""
+    cache = LLMResponseCache(db_manager, ttl_days=7)
+    extraction = HealthDataExtraction(markers=[], document_type="Blood Test Report")
+    call = AsyncMock(return_value=extraction)
+
+    result = await cache.run("key", call, HealthDataExtraction)
+
+    assert result is extraction
+    call.assert_awaited_once()
+    db_manager.save_llm_response.assert_awaited_once_with("key", extraction.model_dump(mode="json"))
+
+@pytest.mark.asyncio
+async def test_cache_hit_skips_model_call(db_manager):
+    """A stored response is validated and returned without calling the model."""
+    db_manager.get_llm_response.return_value = {"markers": [], "document_type": "Blood Test Report"}
+    cache = LLMResponseCache(db_manager, ttl_days=7)
+    call = AsyncMock()
+
+    result = await cache.run("key", call, HealthDataExtraction)
+
+    assert result.document_type == "Blood Test Report"
+    call.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_cache_errors_fall_back_to_model(db_manager):
+    """A failing cache read or write should not fail the request."""
+    db_manager.get_llm_response.side_effect = RuntimeError("table missing")
+    db_manager.save_llm_response.side_effect = RuntimeError("table missing")
+    cache = LLMResponseCache(db_manager, ttl_days=7)
+    extraction = HealthDataExtraction(markers=[], document_type="Blood Test Report")
+
+    assert await cache.run("key", AsyncMock(return_value=extraction), HealthDataExtraction) is extraction
+
+@pytest.mark.asyncio
+async def test_zero_ttl_disables_cache(db_manager):
+    """LLM_CACHE_TTL_DAYS=0 turns the cache into a pass-through."""
+    cache = LLMResponseCache(db_manager, ttl_days=0)
+    extraction = HealthDataExtraction(markers=[], document_type="Blood Test Report")
+
+    await cache.run("key", AsyncMock(return_value=extraction), HealthDataExtraction)
+
+    db_manager.get_llm_response.assert_not_awaited()
+    db_manager.save_llm_response.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_uncacheable_response_is_not_stored(db_manager):
+    """A response rejected by `cacheable` (e.g. an extraction without markers) is returned but not kept."""
+    cache = LLMResponseCache(db_manager, ttl_days=7)
+    extraction = HealthDataExtraction(markers=[], document_type="Blood Test Report")
+
+    result = await cache.run(
+        "key", AsyncMock(return_value=extraction), HealthDataExtraction,
+        cacheable=lambda result: bool(result.markers)
+    )
+
+    assert result is extraction
+    db_manager.save_llm_response.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_refresh_skips_and_replaces_stored_response(db_manager):
+    """On an explicit retry the stored response is ignored and overwritten by the fresh one."""
+    db_manager.get_llm_response.return_value = {"markers": [], "document_type": "Stale"}
+    cache = LLMResponseCache(db_manager, ttl_days=7)
+    extraction = HealthDataExtraction(markers=[], document_type="Blood Test Report")
+
+    result = await cache.run("key", AsyncMock(return_value=extraction), HealthDataExtraction, refresh=True)
+
+    assert result is extraction
+    db_manager.get_llm_response.assert_not_awaited()
+    db_manager.save_llm_response.assert_awaited_once_with("key", extraction.model_dump(mode="json"))
+
+@pytest.mark.asyncio
+async def test_invalid_stored_response_is_a_miss(db_manager):
+    """A stored response that no longer validates is ignored and the model called instead."""
+    db_manager.get_llm_response.return_value = {"markers": "not a list"}
+    cache = LLMResponseCache(db_manager, ttl_days=7)
+    extraction = HealthDataExtraction(markers=[], document_type="Blood Test Report")
+    call = AsyncMock(return_value=extraction)
+
+    assert await cache.run("key", call, HealthDataExtraction) is extraction
+    call.assert_awaited_once()
@@ -0,0 +1,177 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from services.processing_pipeline import ProcessingPipeline
+
+@pytest.fixture
+def pipeline():
+    """Pipeline with a mocked database manager and a 2-document concurrency limit."""
+    pipeline = ProcessingPipeline(MagicMock())
+    pipeline._slots = asyncio.Semaphore(2)
+    return pipeline
+
+@pytest.mark.asyncio
+async def test_schedule_bounds_concurrent_pipelines(pipeline):
+    """No more than the configured number of documents should be processed at once."""
+    running = 0
+    peak = 0
+
+    async def process_document_async(document_id, file_url, filename, refresh=False):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    pipeline.process_document_async = process_document_async
+    for i in range(5):
+        assert pipeline.schedule(f"doc{i}", "http://fake.url/doc.pdf", "doc.pdf")
+
+    await asyncio.gather(*pipeline._tasks.values())
+
+    assert peak == 2
+    assert pipeline._tasks == {}
+
+@pytest.mark.asyncio
+async def test_schedule_rejects_document_already_in_flight(pipeline):
+    """A document that is queued or running should not be scheduled twice."""
+    release = asyncio.Event()
+
+    async def process_document_async(document_id, file_url, filename, refresh=False):
+        await release.wait()
+
+    pipeline.process_document_async = process_document_async
+
+    assert pipeline.schedule("doc1", "http://fake.url/doc.pdf", "doc.pdf") is True
+    assert pipeline.schedule("doc1", "http://fake.url/doc.pdf", "doc.pdf") is False
+
+    release.set()
+    await asyncio.gather(*pipeline._tasks.values())
+
+@pytest.mark.asyncio
+async def test_analysis_overlaps_progress_writes_with_agent_calls(pipeline):
+    """Agent calls should not wait for the progress/raw_text writes to round-trip."""
+    write_started = asyncio.Event()
+    release_write = asyncio.Event()
+
+    async def update_processing_stage(*args):
+        write_started.set()
+        await release_write.wait()
+
+    async def extract_data(ocr_data, refresh=False):
+        # Runs while the stage write is still pending
+        assert write_started.is_set() and not release_write.is_set()
+        release_write.set()
+        return MagicMock(markers=[MagicMock()])
+
+    pipeline.db_manager.update_processing_stage = update_processing_stage
+    pipeline.extraction_agent = MagicMock(extract_data=extract_data)
+    pipeline.insight_agent = MagicMock(generate_insights=AsyncMock(return_value="insights"))
+
+    result = await pipeline._execute_analysis_stage("doc1", {"pages": [{"markdown": "text"}]})
+
+    assert result == "insights"
+
+@pytest.mark.asyncio
+async def test_resume_interrupted_requeues_processing_documents(pipeline):
+    """Documents left in processing by a restart are scheduled again; ones without a URL are skipped."""
+    pipeline.db_manager.list_processing_documents = AsyncMock(return_value=[
+        {"id": "doc1", "filename": "a.pdf", "public_url": "http://fake.url/a.pdf"},
+        {"id": "doc2", "filename": "b.pdf", "public_url": None},
+    ])
+    pipeline.process_document_async = AsyncMock()
+
+    assert await pipeline.resume_interrupted() == 1
+
+    await asyncio.gather(*pipeline._tasks.values())
+    pipeline.process_document_async.assert_awaited_once_with("doc1", "http://fake.url/a.pdf", "a.pdf", False)
+
+@pytest.mark.asyncio
+async def test_save_stage_write_overlaps_visibility_delay(pipeline, monkeypatch):
+    """The SAVING_RESULTS write should run during the visibility delay, not before it."""
+    order = []
+    yield_to_loop = asyncio.sleep
+
+    async def update_processing_stage(*args):
+        await yield_to_loop(0)
+        order.append("stage_write_done")
+
+    async def sleep(delay):
+        order.append("delay")
+
+    pipeline.db_manager.update_processing_stage = update_processing_stage
+    pipeline.db_manager.finalize_document = AsyncMock()
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+
+    await pipeline._execute_save_stage("doc1", MagicMock())
+
+    assert order == ["delay", "stage_write_done"]
+    pipeline.db_manager.finalize_document.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_retry_processing_bypasses_cached_responses(pipeline):
+    """An explicit retry asks the agents for fresh answers instead of replaying cached ones."""
+    pipeline.db_manager.load_document_data = AsyncMock(return_value={
+        "id": "doc1", "status": "error", "filename": "a.pdf", "public_url": "http://fake.url/a.pdf"
+    })
+    pipeline.db_manager.update_document_table = AsyncMock()
+    pipeline.process_document_async = AsyncMock()
+
+    assert await pipeline.retry_processing("doc1") is True
+
+    await asyncio.gather(*pipeline._tasks.values())
+    pipeline.process_document_async.assert_awaited_once_with("doc1", "http://fake.url/a.pdf", "a.pdf", True)
+
+@pytest.mark.asyncio
+async def test_ocr_not_started_when_stage_write_fails(pipeline):
+    """A failed stage write must not leave an OCR request running outside the pipeline slot."""
+    pipeline.db_manager.update_processing_stage = AsyncMock(side_effect=RuntimeError("db down"))
+    pipeline.ocr_agent = MagicMock()
+
+    with pytest.raises(RuntimeError):
+        await pipeline._execute_ocr_stage("doc1", "http://fake.url/doc.pdf")
+
+    pipeline.ocr_agent.extract_structured_data.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_analysis_cancels_agent_call_when_progress_write_fails(pipeline):
+    """A failed progress write must not leave the extraction request running outside the slot."""
+    cancelled = asyncio.Event()
+
+    async def update_processing_stage(*args):
+        await asyncio.sleep(0)
+        raise RuntimeError("db down")
+
+    async def extract_data(ocr_data, refresh=False):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    pipeline.db_manager.update_processing_stage = update_processing_stage
+    pipeline.extraction_agent = MagicMock(extract_data=extract_data)
+
+    with pytest.raises(RuntimeError):
+        await pipeline._execute_analysis_stage("doc1", {"pages": [{"markdown": "text"}]})
+
+    assert cancelled.is_set()
+
+@pytest.mark.asyncio
+async def test_analysis_failure_waits_for_pending_progress_write(pipeline):
+    """When an agent call fails first, the progress write still lands before the error propagates."""
+    write_done = False
+
+    async def update_processing_stage(*args):
+        nonlocal write_done
+        await asyncio.sleep(0.01)
+        write_done = True
+
+    pipeline.db_manager.update_processing_stage = update_processing_stage
+    pipeline.extraction_agent = MagicMock(extract_data=AsyncMock(side_effect=ValueError("bad response")))
+
+    with pytest.raises(ValueError):
+        await pipeline._execute_analysis_stage("doc1", {"pages": [{"markdown": "text"}]})
+
+    assert write_done
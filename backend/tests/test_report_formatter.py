@@ -0,0 +1,19 @@
+from models.health_models import HealthDataExtraction, HealthInsights
+from services.report_formatter import format_insights_as_markdown
+
+def test_format_insights_as_markdown():
+    """The report should contain every section with bulleted findings."""
+    insights = HealthInsights(
+        data=HealthDataExtraction(markers=[], document_type="Blood Test Report"),
+        summary="All values are within range.",
+        key_findings=["Hemoglobin is normal.", "Glucose is normal."],
+        recommendations=["Keep up the healthy lifestyle."],
+        disclaimer="Not medical advice."
+    )
+
+    assert format_insights_as_markdown(insights) == (
+        "# Analysis Report\n\n## Summary\nAll values are within range.\n\n"
+        "## Key Findings\n- Hemoglobin is normal.\n- Glucose is normal.\n\n"
+        "## Recommendations\n- Keep up the healthy lifestyle.\n\n"
+        "---\n\n**Disclaimer:** Not medical advice."
+    )
@@ -24,6 +24,7 @@ export interface HealthDocument {
   readonly error_message?: string;
   readonly progress?: number;
   readonly processing_stage?: 'ocr_extraction' | 'ai_analysis' | 'saving_results' | 'complete';
+  readonly marker_count?: number; // Only present in list responses
 }
 
 // Wrapper class that provides camelCase accessors for snake_case properties
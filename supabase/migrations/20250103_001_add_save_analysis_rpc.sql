@@ -0,0 +1,42 @@
+-- Migration: Add save_analysis_rpc function
+-- Date: 2025-01-03
+-- Description: Saves an analysis result and its health markers in a single call/transaction.
+-- Replaces the SELECT raw_text -> UPSERT analysis_results -> DELETE markers -> INSERT markers
+-- sequence previously issued by the backend as four separate PostgREST round-trips.
+
+CREATE OR REPLACE FUNCTION save_analysis_rpc(
+    p_document_id UUID,
+    p_structured_data JSONB,
+    p_insights TEXT
+)
+RETURNS UUID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_raw_text TEXT;
+    v_analysis_id UUID;
+BEGIN
+    -- Copy the OCR text stored on the document into the analysis record
+    SELECT raw_text INTO v_raw_text FROM documents WHERE id = p_document_id;
+
+    INSERT INTO analysis_results (document_id, raw_text, structured_data, insights)
+    VALUES (p_document_id, v_raw_text, p_structured_data, p_insights)
+    ON CONFLICT (document_id) DO UPDATE
+        SET raw_text = EXCLUDED.raw_text,
+            structured_data = EXCLUDED.structured_data,
+            insights = EXCLUDED.insights
+    RETURNING id INTO v_analysis_id;
+
+    -- Replace markers atomically: readers never observe an empty marker set
+    DELETE FROM health_markers WHERE analysis_id = v_analysis_id;
+
+    -- Markers are read from the structured data itself, so they are not sent twice
+    INSERT INTO health_markers (analysis_id, marker_name, value, unit, reference_range)
+    SELECT v_analysis_id, m->>'marker', m->>'value', m->>'unit', m->>'reference_range'
+    FROM jsonb_array_elements(COALESCE(p_structured_data->'data'->'markers', '[]'::jsonb)) AS m;
+
+    RETURN v_analysis_id;
+END;
+$$;
+
+COMMENT ON FUNCTION save_analysis_rpc(UUID, JSONB, TEXT) IS 'Upserts analysis_results and replaces its health_markers in one transaction';
@@ -0,0 +1,5 @@
+-- Rollback Migration: Remove save_analysis_rpc function
+-- Date: 2025-01-03
+-- Description: Removes the function added in 20250103_001_add_save_analysis_rpc.sql
+
+DROP FUNCTION IF EXISTS save_analysis_rpc(UUID, JSONB, TEXT);
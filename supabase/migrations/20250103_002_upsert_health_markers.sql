@@ -0,0 +1,79 @@
+-- Migration: Upsert health markers instead of delete + insert
+-- Date: 2025-01-03
+-- Description: Adds a unique key on health_markers(analysis_id, marker_name, unit, reference_range)
+-- and updates save_analysis_rpc to upsert markers on that key, then prune the ones no longer present.
+-- Unchanged markers are updated in place rather than deleted and re-inserted.
+-- The same analyte reported twice with a different unit or reference range (e.g. another
+-- specimen) keeps both rows. Rows repeating a whole key within one analysis cannot coexist
+-- with the index: all but the first are moved to health_markers_dedupe_backup, which the
+-- rollback restores, and a save whose markers repeat a key keeps only the first occurrence.
+
+-- Set aside duplicate rows left by earlier saves so the unique index can be built
+CREATE TABLE IF NOT EXISTS health_markers_dedupe_backup (LIKE health_markers);
+
+WITH removed AS (
+    DELETE FROM health_markers hm
+    USING health_markers dup
+    WHERE hm.analysis_id = dup.analysis_id
+      AND hm.marker_name = dup.marker_name
+      AND COALESCE(hm.unit, '') = COALESCE(dup.unit, '')
+      AND COALESCE(hm.reference_range, '') = COALESCE(dup.reference_range, '')
+      AND hm.ctid > dup.ctid
+    RETURNING hm.*
+)
+INSERT INTO health_markers_dedupe_backup SELECT * FROM removed;
+
+-- Unit and reference range may be NULL; COALESCE makes them comparable in the key
+CREATE UNIQUE INDEX IF NOT EXISTS idx_health_markers_analysis_marker_unique
+ON health_markers(analysis_id, marker_name, (COALESCE(unit, '')), (COALESCE(reference_range, '')));
+
+CREATE OR REPLACE FUNCTION save_analysis_rpc(
+    p_document_id UUID,
+    p_structured_data JSONB,
+    p_insights TEXT
+)
+RETURNS UUID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_raw_text TEXT;
+    v_analysis_id UUID;
+    v_markers JSONB := COALESCE(p_structured_data->'data'->'markers', '[]'::jsonb);
+BEGIN
+    -- Copy the OCR text stored on the document into the analysis record
+    SELECT raw_text INTO v_raw_text FROM documents WHERE id = p_document_id;
+
+    INSERT INTO analysis_results (document_id, raw_text, structured_data, insights)
+    VALUES (p_document_id, v_raw_text, p_structured_data, p_insights)
+    ON CONFLICT (document_id) DO UPDATE
+        SET raw_text = EXCLUDED.raw_text,
+            structured_data = EXCLUDED.structured_data,
+            insights = EXCLUDED.insights
+    RETURNING id INTO v_analysis_id;
+
+    -- Upsert markers; DISTINCT ON keeps the first occurrence if a whole key is repeated,
+    -- since ON CONFLICT cannot update the same row twice in one statement
+    INSERT INTO health_markers (analysis_id, marker_name, value, unit, reference_range)
+    SELECT DISTINCT ON (m.value->>'marker', COALESCE(m.value->>'unit', ''), COALESCE(m.value->>'reference_range', ''))
+           v_analysis_id, m.value->>'marker', m.value->>'value', m.value->>'unit', m.value->>'reference_range'
+    FROM jsonb_array_elements(v_markers) WITH ORDINALITY AS m(value, ord)
+    WHERE m.value->>'marker' IS NOT NULL
+    ORDER BY m.value->>'marker', COALESCE(m.value->>'unit', ''), COALESCE(m.value->>'reference_range', ''), m.ord
+    ON CONFLICT (analysis_id, marker_name, (COALESCE(unit, '')), (COALESCE(reference_range, ''))) DO UPDATE
+        SET value = EXCLUDED.value,
+            unit = EXCLUDED.unit,
+            reference_range = EXCLUDED.reference_range;
+
+    -- Prune markers that are no longer part of the analysis
+    DELETE FROM health_markers hm
+    WHERE hm.analysis_id = v_analysis_id
+      AND NOT EXISTS (
+          SELECT 1 FROM jsonb_array_elements(v_markers) AS m
+          WHERE m->>'marker' = hm.marker_name
+            AND COALESCE(m->>'unit', '') = COALESCE(hm.unit, '')
+            AND COALESCE(m->>'reference_range', '') = COALESCE(hm.reference_range, '')
+      );
+
+    RETURN v_analysis_id;
+END;
+$$;
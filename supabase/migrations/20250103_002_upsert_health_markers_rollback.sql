@@ -0,0 +1,47 @@
+-- Rollback Migration: Restore delete + insert marker replacement
+-- Date: 2025-01-03
+-- Description: Reverts 20250103_002_upsert_health_markers.sql to the
+-- save_analysis_rpc body from 20250103_001_add_save_analysis_rpc.sql
+
+CREATE OR REPLACE FUNCTION save_analysis_rpc(
+    p_document_id UUID,
+    p_structured_data JSONB,
+    p_insights TEXT
+)
+RETURNS UUID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_raw_text TEXT;
+    v_analysis_id UUID;
+BEGIN
+    SELECT raw_text INTO v_raw_text FROM documents WHERE id = p_document_id;
+
+    INSERT INTO analysis_results (document_id, raw_text, structured_data, insights)
+    VALUES (p_document_id, v_raw_text, p_structured_data, p_insights)
+    ON CONFLICT (document_id) DO UPDATE
+        SET raw_text = EXCLUDED.raw_text,
+            structured_data = EXCLUDED.structured_data,
+            insights = EXCLUDED.insights
+    RETURNING id INTO v_analysis_id;
+
+    DELETE FROM health_markers WHERE analysis_id = v_analysis_id;
+
+    INSERT INTO health_markers (analysis_id, marker_name, value, unit, reference_range)
+    SELECT v_analysis_id, m->>'marker', m->>'value', m->>'unit', m->>'reference_range'
+    FROM jsonb_array_elements(COALESCE(p_structured_data->'data'->'markers', '[]'::jsonb)) AS m;
+
+    RETURN v_analysis_id;
+END;
+$$;
+
+DROP INDEX IF EXISTS idx_health_markers_analysis_marker_unique;
+
+-- Restore the duplicate rows set aside when the unique index was built
+-- (analyses deleted since then have lost their markers anyway)
+INSERT INTO health_markers
+SELECT b.* FROM health_markers_dedupe_backup b
+WHERE EXISTS (SELECT 1 FROM analysis_results a WHERE a.id = b.analysis_id)
+ON CONFLICT (id) DO NOTHING;
+
+DROP TABLE IF EXISTS health_markers_dedupe_backup;
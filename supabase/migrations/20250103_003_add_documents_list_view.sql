@@ -0,0 +1,27 @@
+-- Migration: Add documents list view
+-- Date: 2025-01-03
+-- Description: Adds documents_list_view, projecting only the columns the document list
+-- needs plus a marker count. The list endpoint no longer has to fetch every document's
+-- structured_data JSONB and insights markdown.
+
+-- A plain view rather than a materialized one: status, progress and processing_stage
+-- change on every pipeline stage, so a materialized copy would serve stale progress
+-- unless refreshed on each of those writes as well.
+CREATE OR REPLACE VIEW documents_list_view AS
+SELECT
+    d.id,
+    d.filename,
+    d.upload_date,
+    d.status,
+    d.processed_at,
+    d.public_url,
+    d.error_message,
+    d.progress,
+    d.processing_stage,
+    (
+        SELECT COUNT(*)
+        FROM health_markers hm
+        JOIN analysis_results ar ON ar.id = hm.analysis_id
+        WHERE ar.document_id = d.id
+    ) AS marker_count
+FROM documents d;
@@ -0,0 +1,5 @@
+-- Rollback Migration: Remove documents list view
+-- Date: 2025-01-03
+-- Description: Reverts 20250103_003_add_documents_list_view.sql
+
+DROP VIEW IF EXISTS documents_list_view;
@@ -0,0 +1,30 @@
+-- Migration: Add finalize_document RPC
+-- Date: 2025-01-04
+-- Description: Adds finalize_document(), which saves the analysis (via save_analysis_rpc)
+-- and marks the document complete in the same transaction, replacing two separate
+-- round-trips at the end of the processing pipeline.
+
+CREATE OR REPLACE FUNCTION finalize_document(
+    p_document_id UUID,
+    p_structured_data JSONB,
+    p_insights TEXT
+)
+RETURNS UUID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_analysis_id UUID;
+BEGIN
+    v_analysis_id := save_analysis_rpc(p_document_id, p_structured_data, p_insights);
+
+    UPDATE documents
+    SET status = 'complete',
+        error_message = NULL,
+        progress = 100,
+        processing_stage = 'complete',
+        processed_at = now()
+    WHERE id = p_document_id;
+
+    RETURN v_analysis_id;
+END;
+$$;
@@ -0,0 +1,5 @@
+-- Rollback Migration: Remove finalize_document RPC
+-- Date: 2025-01-04
+-- Description: Reverts 20250104_001_add_finalize_document_rpc.sql
+
+DROP FUNCTION IF EXISTS finalize_document(UUID, JSONB, TEXT);
@@ -0,0 +1,17 @@
+-- Migration: Add LLM response cache table
+-- Date: 2025-01-05
+-- Description: Adds llm_cache, where the extraction and insight agents store validated
+-- responses keyed by a SHA-256 of model, system prompt and input. Re-processing an
+-- identical document (re-upload, retry) reads the stored response instead of calling
+-- the model again.
+
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    response JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Expired entries are ignored by the backend (LLM_CACHE_TTL_DAYS) and overwritten on the
+-- next miss; this index keeps an occasional purge of old rows cheap:
+--   DELETE FROM llm_cache WHERE created_at < now() - interval '7 days';
+CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at ON llm_cache (created_at);
@@ -0,0 +1,5 @@
+-- Rollback Migration: Remove LLM response cache table
+-- Date: 2025-01-05
+-- Description: Reverts 20250105_001_add_llm_cache.sql
+
+DROP TABLE IF EXISTS llm_cache;
@@ -0,0 +1,13 @@
+-- Migration: Add idempotency key to documents
+-- Date: 2025-01-06
+-- Description: Adds documents.idempotency_key, set from the upload's Idempotency-Key
+-- header. A replayed upload (client retry after a timeout, double submit) returns
+-- the document created the first time instead of storing and analysing the file again.
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+
+-- Partial: most uploads carry no key
+CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_idempotency_key
+ON documents(idempotency_key) WHERE idempotency_key IS NOT NULL;
+
+COMMENT ON COLUMN documents.idempotency_key IS 'Client-supplied Idempotency-Key of the upload that created the document';
@@ -0,0 +1,6 @@
+-- Rollback Migration: Remove idempotency key from documents
+-- Date: 2025-01-06
+-- Description: Reverts 20250106_001_add_documents_idempotency_key.sql
+
+DROP INDEX IF EXISTS idx_documents_idempotency_key;
+ALTER TABLE documents DROP COLUMN IF EXISTS idempotency_key;